@@ -1,8 +1,16 @@
 
 from threading import current_thread
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 import warnings
+from stage_timing import timed_stage, timed_generator, StageTimer, get_logger
+from curve_writer import insert_frames, dbapi_replace, FORWARD_CURVE_COLUMNS, BATCH_SIZE
+from curve_fingerprint import partition_fingerprints, load_fingerprints, dirty_partitions, save_fingerprints
+import curve_store
+import curve_shaping
+import curve_calendar
 warnings.filterwarnings("ignore")
 
 """
@@ -25,6 +33,39 @@ This program takes commodity future contract prices data from the 'input table'
 
 """
 
+#Number of workers building the (commodity, market, exchange) partitions of the curves. 1 builds them serially in this
+#   process, more workers are opt-in (ex. os.cpu_count() with CURVE_EXECUTOR = 'process')
+CURVE_WORKERS = 1
+
+#Pool of the workers when CURVE_WORKERS != 1: 'thread' shares the contracts of the process,
+#   'process' pickles each partition to a worker process, opt-in for large universes on many cores
+CURVE_EXECUTOR = 'thread'
+
+#Rebuild only the (commodity, market, exchange) partitions whose contracts changed since the last run of the trade date
+INCREMENTAL_REBUILD = True
+
+#DB-API connection factory of the output table, ex. functools.partial(pymysql.connect, host=..., user=..., database=...).
+#   When set, the curves of each partition are replaced in one transaction (curve_writer.dbapi_replace), otherwise
+#   through the framework calls (framework_replace), whose delete and inserts may commit separately
+OUTPUT_CONNECTION = None
+
+#Placeholder style of the OUTPUT_CONNECTION driver: '%s' for pymysql and MySQLdb, '?' for sqlite3
+OUTPUT_PARAMSTYLE = '%s'
+
+#Keep a parquet copy (curve_store) of the retrieved contracts and of the built curves, when pyarrow is installed
+SNAPSHOT_STORE = curve_store.pa is not None
+
+#Replace the stitched price of the mixed curves by the arbitrage-free shaped one (curve_shaping, requires scipy)
+SHAPE_MIXED_CURVE = False
+
+#Input columns held as categories: few distinct values, repeated on every expanded daily row
+CATEGORY_COLUMNS = ['commodity', 'market', 'exchange', 'currency', 'unit', 'contractType', 'contractName']
+
+#Contract tiers, ordered from the shortest to the longest contract
+CONTRACT_TIERS = ['a_day', 'b_weekend', 'c_week', 'd_month', 'e_quarter', 'f_season', 'g_year']
+
+FEATURE_DTYPES = {'days': np.int16, 'month': np.int8, 'quarter': np.int8, 'year': np.int16}
+
 
 @DecorateErrorHandling
 def getTablesName():
@@ -33,6 +74,7 @@ def getTablesName():
 
 
 @DecorateErrorHandling
+@timed_stage()
 def getsqldata(tbl_dict):
     """
 
@@ -56,30 +98,111 @@ def getsqldata(tbl_dict):
     results = getValuesFromTable(sql_last_bd.format(tb_name=tb.commodities_prices_table(tb.SYNCED)))
     if len(results) == 0:    #if download is not synced
         results = getValuesFromTable(sql_last_download.format(tb_name=tb.commodities_prices_table(tb.SYNCED)))
+    return contracts_from_records(results)
+
+
+@DecorateErrorHandling
+@timed_stage()
+def getsqldata_range(start_date, end_date, chunk_days=None):
+    """
+
+    :param start_date: first trade date to retrieve, ex. '2019-01-01'
+    :param end_date: last trade date to retrieve (included)
+    :param chunk_days: None retrieves the whole range in one query, otherwise one query per chunk_days trade dates
+    :return: dataframe of all commodities contract prices of the trade dates, ordered by utcTimeStamp
+    """
+    # range on utcTimeStamp itself (no DATE()) so the index on utcTimeStamp is used
+    sql_range = ''' SELECT *
+            FROM {tb_name}
+            WHERE utcTimeStamp >= '{start_date}' AND utcTimeStamp < '{end_date}' + INTERVAL 1 DAY
+            ORDER BY utcTimeStamp, commodity, deliveryStart '''
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    step = pd.Timedelta(days=chunk_days) if chunk_days else end_date - start_date + pd.Timedelta(days=1)
+    results = []
+    while start_date <= end_date:
+        chunk_end = min(start_date + step - pd.Timedelta(days=1), end_date)
+        results.extend(getValuesFromTable(sql_range.format(tb_name=tb.commodities_prices_table(tb.SYNCED),
+                                                           start_date=start_date.strftime("%Y-%m-%d"),
+                                                           end_date=chunk_end.strftime("%Y-%m-%d"))))
+        start_date = chunk_end + pd.Timedelta(days=1)
+    return contracts_from_records(results)
+
+
+def contracts_from_store(trade_date=None, store_dir=None):
+    """
+
+    :param trade_date: trade date of the contracts, the last one stored by default
+    :param store_dir: root directory of the store, curve_store.STORE_DIR by default
+    :return: dataframe of commodities contract prices stored by runMainFunction in curve_store, as returned by getsqldata.
+             Rebuilds the curves of a trade date without the database
+    """
+    df = curve_store.read_snapshot('contracts', trade_date, store_dir=store_dir)
+    return apply_schema(df[list(contracts_from_records([]).columns)])
+
+
+def contracts_from_records(results):
+    """
+
+    :param results: rows of the commodities prices table
+    :return: dataframe of commodities contract prices with the schema of apply_schema
+    """
     columnNames = ["commodity", "market", "exchange", "currency", "unit", "contractType", "contractName",
                    "utcTimeStamp", "locTimeStamp", "price",  "open", "high", "low",  "oi", "volume", "deliveryStart",
                    "deliveryEnd"]
 
     df = pd.DataFrame.from_records(list(results), columns=columnNames)
     df = df.assign(days=0, month=0, quarter=0, season='', year=0)
-    df['deliveryStart'] = pd.to_datetime(df.deliveryStart, format="%Y-%m-%d", exact=True)
-    df['deliveryEnd'] = pd.to_datetime(df.deliveryEnd, format="%Y-%m-%d",exact=True)
-    return df
+    return apply_schema(df)
+
+
+def compact_float(values):
+    """
+    :param values: pandas series of prices
+    :return: float32 series if every value comes back unchanged through its float32 decimal representation
+             (see curve_writer.convert_column), float64 series otherwise
+    """
+    if values.dtype == np.float32:
+        return values
+    values = pd.to_numeric(values, errors='coerce').astype(np.float64)
+    unique = pd.unique(values.dropna().values)  # prices repeat a lot, check each distinct price once
+    same = unique.astype(np.float32).astype(str).astype(np.float64) == unique
+    return values.astype(np.float32) if same.all() else values
 
 
-def fill_quarterly_values(month):
+def compact_int(values):
+    """
+    :param values: pandas series of volumes, open interests
+    :return: int32 series if all values are integers within int32 range, compact_float(values) otherwise
     """
-    :param month: Commodities contract month values, 1-January, 2-February
-    :return: return quarter values corresponding to month[ QTR1-Jan,Feb, Mar], QTR2-Apr,May,June] etc
+    values = pd.to_numeric(values, errors='coerce')
+    if values.notnull().all() and (values % 1 == 0).all() and values.abs().max() < np.iinfo(np.int32).max:
+        return values.astype(np.int32)
+    return compact_float(values)
+
+
+def apply_schema(df):
     """
-    if month in [1, 2, 3]:
-        return 1
-    elif month in [4, 5, 6]:
-        return 2
-    elif month in [7, 8, 9]:
-        return 3
-    elif month in [10, 11, 12]:
-        return 4
+
+    :param df: dataframe of commodities contract prices, as retrieved from the database or a csv dump
+    :return: same dataframe with compact dtypes: categories for the repeated strings, datetime64 for the dates,
+             float32/int32 for prices and volumes where no value changes, small integers for the date features.
+             Strings (dates, contract tiers) are only formatted at the output boundary (curve_writer)
+    """
+    for column in CATEGORY_COLUMNS + ['season']:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    if 'contract' in df.columns:
+        df['contract'] = pd.Categorical(df['contract'], categories=CONTRACT_TIERS, ordered=True)
+    for column in ['utcTimeStamp', 'locTimeStamp', 'deliveryStart', 'deliveryEnd']:
+        df[column] = pd.to_datetime(df[column])
+    for column in ['price', 'open', 'high', 'low']:
+        df[column] = compact_float(df[column])
+    for column in ['oi', 'volume']:
+        df[column] = compact_int(df[column])
+    for column, dtype in FEATURE_DTYPES.items():
+        if column in df.columns and df[column].notnull().all():
+            df[column] = df[column].astype(dtype)
+    return df
 
 
 @DecorateErrorHandling
@@ -106,19 +229,28 @@ def contract_type(df):
         return 'g_year'
 
 @DecorateErrorHandling
+@timed_stage()
 def fill_month_quarter_values(df):
     """
 
     :param df: dataframe of commodities contract prices
     :return: dataframe of commodities contract prices with additional columns using several self-made functions for easier data parsing
     """
-    df['days'] = [d.days + 1 for d in df.deliveryEnd - df.deliveryStart]
+    df['days'] = (df.deliveryEnd - df.deliveryStart).dt.days + 1
     df['month'] = df['deliveryStart'].dt.month
-    df['quarter'] = df['month'].apply(fill_quarterly_values)
+    df['quarter'] = (df['month'] - 1) // 3 + 1   # QTR1-Jan,Feb,Mar, QTR2-Apr,May,June etc
     df['year'] = df['deliveryStart'].dt.year
-    df['season'] = [('winter' + str(x.year)) if x.month in [10, 11, 12, 1, 2, 3] else 'summer' + str(x.year) for x in df['deliveryStart'].dropna()]
-    df['contract'] = df['contractType'].apply(contract_type)
-    return df
+
+    # season of deliveryStart: winter Oct-Mar, summer Apr-Sep, labels built once per (year, season)
+    season = pd.Categorical(df['year'] * 2 + df['month'].isin([10, 11, 12, 1, 2, 3]))
+    df['season'] = season.rename_categories([('winter' if k % 2 else 'summer') + str(int(k // 2)) for k in season.categories])
+
+    # contract tier classified once per distinct contractType, mapped back through the category codes
+    contract_types = df['contractType'].astype('category').cat
+    tier_codes = [CONTRACT_TIERS.index(t) if t in CONTRACT_TIERS else -1 for t in map(contract_type, contract_types.categories)]
+    df['contract'] = pd.Categorical.from_codes(np.array(tier_codes + [-1], dtype=np.int8)[contract_types.codes],
+                                               categories=CONTRACT_TIERS, ordered=True)
+    return apply_schema(df)
 
 
 def build_date_index(df):
@@ -128,9 +260,9 @@ def build_date_index(df):
     :return: working dataframe with index=daterange corresponding to commodities contract in input df
     """
     #Builds the working (empty) dataframe with the index which are the date ranges between DeliveryStart and DeliveryEnd
-    start_value = sorted(list(df.deliveryStart.dropna()))[0]
-    end_value = sorted(list(df.deliveryEnd.dropna()))[-1]
-    column_range = pd.date_range(start=start_value, end=end_value).strftime("%Y-%m-%d")
+    start_value = curve_calendar.span(df.deliveryStart)[0]
+    end_value = curve_calendar.span(df.deliveryEnd)[1]
+    column_range = curve_calendar.date_labels(start_value, end_value)
     column = ['dateIndex'] + list(df.columns)
     newTable = pd.DataFrame(columns=column,index=column_range)
     return newTable
@@ -153,6 +285,111 @@ def append_date_index(df, newTable):
             newTable.loc[dates] = [str(dates)] + list((df.loc[indx]))
     return newTable
 
+
+def expand_contract_days(df, keys, keep='last', writes=None):
+    """
+
+    :param df: dataframe of commodities contract prices (cleaned)
+    :param keys: columns identifying one curve, ex. ['commodity', 'market', 'exchange', 'contract']
+    :param keep: 'last' if later contracts overwrite earlier ones on the same day, 'first' if the first writer wins
+    :param writes: boolean mask of the contracts allowed to write their delivery days, all of them if None.
+                   The calendar of each curve still spans every contract of df
+    :return: dataframe with one row per (curve, day) between first deliveryStart and last deliveryEnd of each curve
+
+    vectorized equivalent of build_date_index + append_date_index + ffill, done for every curve in one pass:
+    the delivery window of each contract is exploded with repeat/offset arithmetic, one contract is kept
+    per day, and days without a contract take the row of the previous written day of the same curve
+    """
+    column = ['dateIndex'] + list(df.columns)
+    df = df.reset_index(drop=True)
+    starts = pd.to_datetime(df.deliveryStart).values.astype('datetime64[D]')
+    ends = pd.to_datetime(df.deliveryEnd).values.astype('datetime64[D]')
+
+    # One row per delivery day of each contract
+    lengths = np.maximum((ends - starts).astype(np.int64) + 1, 0)
+    if writes is not None:
+        lengths = np.where(np.asarray(writes, dtype=bool), lengths, 0)
+    positions = np.repeat(np.arange(len(df)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    expanded = df.take(positions).reset_index(drop=True)
+    expanded.insert(0, 'dateIndex', starts[positions] + offsets.astype('timedelta64[D]'))
+    expanded.drop_duplicates(keys + ['dateIndex'], keep=keep, inplace=True)
+    expanded.reset_index(drop=True, inplace=True)
+
+    # Full daily calendar of each curve, between its first deliveryStart and its last deliveryEnd
+    bounds = pd.DataFrame({'start': starts, 'end': ends}).groupby([df[k] for k in keys], sort=True, observed=True)
+    bounds = pd.concat([bounds.start.min(), bounds.end.max()], axis=1).reset_index()
+    first_day, last_day = bounds.start.values.astype('datetime64[D]'), bounds.end.values.astype('datetime64[D]')
+    spans = np.maximum((last_day - first_day).astype(np.int64) + 1, 0)
+    calendar = bounds[keys].take(np.repeat(np.arange(len(bounds)), spans)).reset_index(drop=True)
+    offsets = np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans)
+    calendar['dateIndex'] = np.repeat(first_day, spans) + offsets.astype('timedelta64[D]')
+
+    # Row of the last written day on or before each calendar day of the same curve: one index array
+    # carried forward, then a single take of all the columns instead of a forward fill per column
+    curve = np.repeat(np.arange(len(bounds)), spans)
+    written = calendar.merge(expanded[keys + ['dateIndex']].assign(row=np.arange(len(expanded))),
+                             on=keys + ['dateIndex'], how='left').row.values
+    latest = np.maximum.accumulate(np.where(np.isnan(written), -1, np.arange(len(calendar))))
+    latest = np.where((latest >= 0) & (curve[np.maximum(latest, 0)] == curve), latest, -1)  # not carried from the previous curve
+    source = np.where(latest >= 0, written[np.maximum(latest, 0)], -1).astype(np.int64)
+    filled = [c for c in column if c not in keys + ['dateIndex']]
+    final_table = pd.concat([calendar, expanded[filled].reindex(source).reset_index(drop=True)], axis=1)
+    blanks = [c for c in filled if expanded[c].isnull().any()]  # blank values of the written days are filled from the days before
+    if blanks:
+        final_table[blanks] = final_table.groupby(keys, sort=False, observed=True)[blanks].ffill()
+    for c in filled:  # calendar days merged in as NaN turn integer columns to float, restore them once filled
+        if df[c].dtype.kind in 'iub' and final_table[c].notnull().all():
+            final_table[c] = final_table[c].astype(df[c].dtype)
+    final_table['dateIndex'] = pd.to_datetime(final_table.dateIndex)
+    final_table.index = final_table.dateIndex.values
+    return final_table[column]
+
+
+def partition_contracts(df, keys=('commodity', 'market', 'exchange')):
+    """
+
+    :param df: dataframe of commodities contract prices
+    :param keys: columns identifying one partition
+    :return: list of sub-dataframes, one per (commodity, market, exchange), sorted by partition key
+    """
+    return [partition for _, partition in df.groupby(list(keys), sort=True, observed=True)]
+
+
+def run_partitions(function, df, max_workers=1, executor='process'):
+    """
+
+    :param function: module level function building the curves of a dataframe of contracts, ex. single_curve_table
+    :param df: dataframe of commodities contract prices
+    :param max_workers: 1 calls function once on the whole df, otherwise the number of pool workers (None: one per cpu)
+    :param executor: 'process' for a ProcessPoolExecutor, 'thread' for a ThreadPoolExecutor
+    :return: list of function outputs, in partition key order whatever the order the workers finish in
+    """
+    if max_workers == 1 or df.empty:
+        return [function(df)]
+    return list(iter_partitions(function, df, max_workers, executor))
+
+
+def iter_partitions(function, df, max_workers=1, executor='process'):
+    """
+
+    :param function: module level function building the curves of a dataframe of contracts, ex. single_curve_table
+    :param df: dataframe of commodities contract prices
+    :param max_workers: 1 builds the partitions one after the other in this process, otherwise the number of pool workers
+    :param executor: 'process' for a ProcessPoolExecutor, 'thread' for a ThreadPoolExecutor
+    :return: generator of function outputs, one per partition in partition key order
+    """
+    partitions = partition_contracts(df)
+    if max_workers == 1:
+        for partition in partitions:
+            yield function(partition)
+        return
+    pool = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    with pool(max_workers=max_workers) as workers:
+        for final_table in workers.map(function, partitions):
+            yield final_table
+
+
 @DecorateErrorHandling
 def append_country(df):
     """
@@ -164,23 +401,37 @@ def append_country(df):
     return df
 
 @DecorateErrorHandling
-def clean_data(df):
+@timed_stage()
+def clean_data(df, as_of=None):
     """
 
     :param df: dataframe of commodities contract prices
+    :param as_of: date of the run, contracts delivering before its year are dropped. Today by default
     :return: cleaned dataframe of commodities contract prices, with various data wrangling methods carried out
     """
     df.dropna(subset=['deliveryStart', 'deliveryEnd', 'volume', 'price'], inplace=True)
     df.drop_duplicates(['commodity', 'market', 'exchange', 'deliveryStart', 'deliveryEnd'], keep='last', inplace=True)
     df['deliveryStart'] = pd.to_datetime(df.deliveryStart, format="%Y-%m-%d", exact=True)
     df['deliveryEnd'] = pd.to_datetime(df.deliveryEnd, format="%Y-%m-%d", exact=True)
-    df.drop(df[df.deliveryStart.dt.year < pd.datetime.today().year].index, inplace=True)
-    df['deliveryStart'] = df.deliveryStart.dt.strftime("%Y-%m-%d")
-    df['deliveryEnd'] = df.deliveryEnd.dt.strftime("%Y-%m-%d")
-    df = df.applymap(lambda s: s.lower() if type(s) == str else s)
+    as_of_year = pd.Timestamp(as_of).year if as_of is not None else pd.datetime.today().year
+    df.drop(df[df.deliveryStart.dt.year < as_of_year].index, inplace=True)
+    for column in df.columns:
+        if df[column].dtype == object or pd.api.types.is_categorical_dtype(df[column]):
+            df[column] = lower_strings(df[column])
     return df
 
 
+def lower_strings(values):
+    """
+    :param values: pandas series
+    :return: series with string values lowercased. Categories are lowercased once per category instead of once per row
+    """
+    lowered = values.map(lambda s: s.lower() if type(s) == str else s)
+    if pd.api.types.is_categorical_dtype(values) and not pd.api.types.is_categorical_dtype(lowered):
+        lowered = lowered.astype('category')  # two categories differing by case only
+    return lowered
+
+
 @DecorateErrorHandling
 def append_value(date_range, newTable, df_subset, indx):
     """
@@ -200,18 +451,139 @@ def append_value(date_range, newTable, df_subset, indx):
     else:
         return newTable
 
+def mixed_curve_writers(df):
+    """
+
+    :param df: cleaned dataframe of commodities contract prices
+    :return: boolean series, True for the contracts that append their delivery days to the mixed curve
+
+    Same rules as create_mixed_curve_loop, with the status of the other contracts of the same
+    commodity_market_exchange_year (and quarter, season) counted once per group instead of re-filtering per contract.
+    All counts exclude the contract itself
+    """
+    year_keys = [df.commodity, df.market, df.exchange, df.year]
+    quarter_keys = year_keys + [df.quarter]
+    season_keys = year_keys + [df.season]
+    contract = df.contract
+    zero = (df.volume == 0)
+    status = pd.DataFrame({'one': 1,
+                           'zero': zero.astype(int),
+                           'longer': contract.isin(['e_quarter', 'f_season', 'g_year']).astype(int),
+                           'season_year': contract.isin(['f_season', 'g_year']).astype(int),
+                           'year': (contract == 'g_year').astype(int)}, index=df.index)
+    in_year = status.groupby(year_keys, observed=True).transform('sum') - status
+    in_quarter = status.groupby(quarter_keys, observed=True).transform('sum') - status
+    in_season = status.groupby(season_keys, observed=True).transform('sum') - status
+
+    months_in_quarter_empty = in_quarter.one == 0
+    zero_in_quarter = in_quarter.zero > 0
+    short_term = contract.isin(['a_day', 'b_weekend', 'c_week'])
+    month = (contract == 'd_month') & (~zero | (in_quarter.longer == 0))
+    quarter = (contract == 'e_quarter') & ~(zero & (in_year.season_year > 0)) & (months_in_quarter_empty | zero_in_quarter)
+    season = (contract == 'f_season') & ~(zero & (in_year.year > 0)) & months_in_quarter_empty
+    year = (contract == 'g_year') & ((in_season.one == 0) | (in_season.zero > 0))
+    return short_term | month | quarter | season | year
+
+
 @DecorateErrorHandling
-def create_mixed_curve(df):
+@timed_stage()
+def create_mixed_curve(df, vectorized=True, max_workers=1, executor='process', as_of=None):
     """
 
     :param df: dataframe of commodities contract prices
+    :param vectorized: build all curves in one pass with mixed_curve_writers and expand_contract_days,
+                       False runs the contract by contract path
+    :param max_workers: number of workers building the (commodity, market, exchange) partitions, 1 builds them serially
+    :param executor: 'process' or 'thread' pool used when max_workers != 1
+    :param as_of: date of the run passed to clean_data, today by default
     :return: Final dataframe of commodities contract prices forward curve.
             This will contain multiple contracts concatenated to build a forward curve
             with daterange between first and last available contract type for each commodity
     """
-    df = clean_data(df)
+    df = clean_data(df, as_of)
+    function = mixed_curve_table if vectorized else create_mixed_curve_loop
+    final_table = pd.concat(run_partitions(function, df, max_workers, executor))
+    return name_contracts(final_table, 'mixed_curve')
+
+
+@timed_stage('create_mixed_curve')
+def iter_mixed_curves(df, vectorized=True, max_workers=1, executor='process', as_of=None):
+    """
+
+    :param df: dataframe of commodities contract prices
+    :param vectorized: see create_mixed_curve
+    :param max_workers: see create_mixed_curve
+    :param executor: see create_mixed_curve
+    :param as_of: see create_mixed_curve
+    :return: generator of the mixed curves, one dataframe per (commodity, market, exchange) in partition key order
+    """
+    df = clean_data(df, as_of)
+    function = mixed_curve_table if vectorized else create_mixed_curve_loop
+    for final_table in iter_partitions(function, df, max_workers, executor):
+        yield name_contracts(final_table, 'mixed_curve')
+
+
+def shaping_contracts(df):
+    """
+
+    :param df: cleaned dataframe of commodities contract prices
+    :return: contracts whose average price the shaped mixed curve reproduces: the active ones (volume>0)
+             and the ones appended to the mixed curve
+    """
+    return df[(df.volume != 0) | mixed_curve_writers(df)]
+
+
+@DecorateErrorHandling
+@timed_stage()
+def shape_mixed_curve(final_table, df):
+    """
+
+    :param final_table: mixed curves, output of create_mixed_curve or a partition of iter_mixed_curves
+    :param df: cleaned dataframe of commodities contract prices of the curves
+    :return: mixed curves with the daily price shaped so that it averages to the price of every active contract
+             over its delivery days (curve_shaping.shape_curves), smooth in between
+    """
+    keys = ['commodity', 'market', 'exchange']
+    hubs = pd.MultiIndex.from_arrays([final_table[k].astype(str) for k in keys]).unique()
+    contracts = df[pd.MultiIndex.from_arrays([df[k].astype(str) for k in keys]).isin(hubs)]  # hubs of the partition only
+    return curve_shaping.shape_curves(final_table, shaping_contracts(contracts), keys)
+
+
+def name_contracts(final_table, curve_type):
+    """
+
+    :param final_table: forward curve dataframe, with contract tiers as 'd_month'
+    :param curve_type: 'single_curve' or 'mixed_curve'
+    :return: forward curve dataframe with contract tiers as 'month' and the curve_type column
+    """
+    contract = final_table.contract.astype('category')
+    final_table['contract'] = contract.cat.rename_categories([str(c).split('_')[-1] for c in contract.cat.categories])
+    final_table['contractType'] = final_table.contract
+    final_table['curve_type'] = pd.Categorical.from_codes(np.zeros(len(final_table), dtype=np.int8), [curve_type])
+    return final_table
+
+
+def mixed_curve_table(df):
+    """
+
+    :param df: cleaned dataframe of commodities contract prices
+    :return: mixed curves of all the (commodity, market, exchange) in df, before renaming of the contract tiers
+    """
+    keys = ['commodity', 'market', 'exchange']
+    # precedence: year by year, shortest contract first; the first contract written on a day keeps it
+    df = df.sort_values(by=keys + ['year', 'contract', 'deliveryEnd', 'deliveryStart'], kind='mergesort')
+    final_table = expand_contract_days(df, keys, keep='first', writes=mixed_curve_writers(df))
+    return final_table[final_table.price.notnull()]  # days before the first appended contract
+
+
+def create_mixed_curve_loop(df):
+    """
+
+    :param df: cleaned dataframe of commodities contract prices
+    :return: mixed curves built contract by contract with append_value (reference path for the benchmark)
+    """
     column = ['dateIndex'] + list(df.columns)
-    final_table = pd.DataFrame(columns=column,)
+    tables = [pd.DataFrame(columns=column,)]
 
     for commodity_name in list(set(df.commodity)):  # Subsetting dataframe by commodity
 
@@ -343,24 +715,65 @@ def create_mixed_curve(df):
                                 newTable = append_value(date_range, newTable, df_subset, indx)  # append to working dataframe
 
                 newTable['dateIndex'] = newTable.index
-                final_table = pd.concat([final_table,newTable]).drop_duplicates()
+                tables.append(newTable)
     #Putting it all together and filling out dates with no contracts
+    final_table = pd.concat(tables).drop_duplicates()
     final_table.fillna(method='ffill', inplace=True, )
-    final_table['contract'] = [str(d).split('_')[-1] for d in final_table.contract]
-    final_table['contractType'] = final_table.contract
-    final_table['curve_type'] = 'mixed_curve'
     return final_table
 
 @DecorateErrorHandling
-def create_single_curves(df):
+@timed_stage()
+def create_single_curves(df, vectorized=True, max_workers=1, executor='process'):
     """
     :param df: dataframe of commodities contract prices
+    :param vectorized: build all curves in one pass with expand_contract_days, False runs the row-by-row append_date_index path
+    :param max_workers: number of workers building the (commodity, market, exchange) partitions, 1 builds them serially
+    :param executor: 'process' or 'thread' pool used when max_workers != 1
     :return: Final dataframe of commodities contract prices forward curve.
             This will contain forward curves for each contractype available
             with daterange between first and last available contract for each commodity
     """
+    function = single_curve_table if vectorized else create_single_curves_loop
+    final_table = pd.concat(run_partitions(function, df, max_workers, executor))
+    return name_contracts(final_table, 'single_curve')
+
+
+@timed_stage('create_single_curves')
+def iter_single_curves(df, vectorized=True, max_workers=1, executor='process'):
+    """
+    :param df: dataframe of commodities contract prices
+    :param vectorized: see create_single_curves
+    :param max_workers: see create_single_curves
+    :param executor: see create_single_curves
+    :return: generator of the single curves, one dataframe per (commodity, market, exchange) in partition key order
+    """
+    function = single_curve_table if vectorized else create_single_curves_loop
+    for final_table in iter_partitions(function, df, max_workers, executor):
+        yield name_contracts(final_table, 'single_curve')
 
-    final_table = pd.DataFrame()        #Initializing final output table
+
+def single_curve_table(df):
+    """
+    :param df: cleaned dataframe of commodities contract prices
+    :return: single curves of all the (commodity, market, exchange, contract) in df, before renaming of the contract tiers
+    """
+    keys = ['commodity', 'market', 'exchange', 'contract']
+    df = df[df.contract.notnull()]
+
+    #Subset of contracts with non-zero volumes, up to the last active contract of each curve
+    position = df.groupby(keys, sort=False, observed=True).cumcount()
+    last_active = position.where(df.volume != 0).groupby([df[k] for k in keys], sort=False, observed=True).transform('max')
+    keep = df.contract.isin(['a_day', 'b_weekend', 'c_week']) | last_active.isnull() | ((last_active > 0) & (position <= last_active))
+    return expand_contract_days(df[keep], keys)
+
+
+def create_single_curves_loop(df):
+    """
+    :param df: dataframe of commodities contract prices
+    :return: single curves built contract by contract with build_date_index and append_date_index (reference path for the benchmark)
+    """
+
+    tables = [pd.DataFrame()]        #Initializing final output tables, concatenated once at the end
 
     for commodity_name in list(set(df.commodity)):  # Subsetting dataframe by commodity
         commodity_df = df[df.commodity == commodity_name]
@@ -388,62 +801,295 @@ def create_single_curves(df):
                     newTable = append_date_index(df_, newTable)
                     newTable.fillna(method='ffill', inplace=True, )
                     newTable['dateIndex'] = newTable.index
-                    final_table = pd.concat([final_table, newTable])
-
-    final_table['contract'] = [str(d).split('_')[-1] for d in final_table.contract]
-    final_table['contractType'] = final_table.contract
-    final_table['curve_type'] = 'single_curve'
-    return final_table
+                    tables.append(newTable)
+    return pd.concat(tables)
 
 
 @DecorateErrorHandling
-def insertValuetoSQL(df):
+@timed_stage()
+def insertValuetoSQL(df, insert=None, table_name=None, batch_size=BATCH_SIZE):
     """
-    :param df: commodities contract prices forward curve
-    :return:
+    :param df: commodities contract prices forward curve, or generator of forward curve partitions
+    :param insert: insert(table_name, columns, rows) function, insertValuesIntoTable by default.
+                   curve_writer.sqlite_insert for the local SQLite stand-in
+    :param table_name: output table, tb.commodity_price_forward_curve_table(tb.UNSYNCED) by default
+    :param batch_size: number of rows sent per insert
+    :return: number of rows inserted
+    """
+    insert = insert or insertValuesIntoTable
+    table_name = table_name or tb.commodity_price_forward_curve_table(tb.UNSYNCED)
+    return insert_frames(df, table_name, FORWARD_CURVE_COLUMNS, insert, batch_size)
+
+
+def partition_delete_sql(partition, table_name):
+    """
+    :param partition: row with tradeDate, commodity, market, exchange (output of partition_fingerprints)
+    :param table_name: output table
+    :return: DELETE statement of the single and mixed curves of the partition for its trade date
+    """
+    sql = """ DELETE FROM {tb_name}
+              WHERE utcTradeDate >= '{tradeDate}' AND utcTradeDate < '{nextDate}'
+              AND commodity = '{commodity}' AND market = '{market}' AND exchange = '{exchange}' """
+    trade_date = pd.Timestamp(partition.tradeDate)
+    return sql.format(tb_name=table_name,
+                      tradeDate=trade_date.strftime("%Y-%m-%d"),
+                      nextDate=(trade_date + pd.Timedelta(days=1)).strftime("%Y-%m-%d"),
+                      commodity=str(partition.commodity).replace("'", "''"),
+                      market=str(partition.market).replace("'", "''"),
+                      exchange=str(partition.exchange).replace("'", "''"))
+
+
+def framework_replace(table_name, delete_sql, tables, column_types, batch_size=BATCH_SIZE):
+    """
+    replace function used when no OUTPUT_CONNECTION is configured: the framework only exposes getValuesFromTable,
+    a query helper which runs the DELETE statement as well, and insertValuesIntoTable. Both may commit on their own,
+    so the rows of the partition are counted back: a partition whose delete or insert did not go through is emptied
+    again and reported as failed, to be rebuilt by the next run
+    :return: number of rows inserted
+    """
+    count_sql = delete_sql.replace('DELETE FROM', 'SELECT COUNT(*) FROM', 1)
+    getValuesFromTable(delete_sql)
+    count = insert_frames(tables, table_name, column_types, insertValuesIntoTable, batch_size)
+    stored = int(list(getValuesFromTable(count_sql))[0][0])
+    if stored != count:
+        getValuesFromTable(delete_sql)
+        raise RuntimeError('%s rows of the partition found after inserting %s' % (stored, count))
+    return count
+
+
+@contextmanager
+def output_replace(replace=None):
+    """
+    :param replace: replace function to use as is, see replacePartitionsInSQL
+    :return: context yielding the replace function of the output table: replace when given, else
+             curve_writer.dbapi_replace on an OUTPUT_CONNECTION connection, closed on exit, else framework_replace
     """
-    df_list = df.values.tolist()
-    columns_name = df.columns
-    insertValuesIntoTable(tb.commodity_price_forward_curve_table(tb.UNSYNCED), columns_name, df_list)
-    return
+    if replace is not None:
+        yield replace
+    elif OUTPUT_CONNECTION is None:
+        get_logger().warning('No OUTPUT_CONNECTION configured, partitions are replaced through the framework calls,'
+                             ' not in one transaction')
+        yield framework_replace
+    else:
+        connection = OUTPUT_CONNECTION()
+        try:
+            yield dbapi_replace(connection, OUTPUT_PARAMSTYLE)
+        finally:
+            connection.close()
+
+
+def partition_tables(df):
+    """
+    :param df: dataframe with columns commodity, market, exchange
+    :return: {partition_key: rows of df of the partition}
+    """
+    return {tuple(str(value) for value in key): rows
+            for key, rows in df.groupby(['commodity', 'market', 'exchange'], observed=True, sort=False)}
+
+
+def partition_key(df):
+    """
+    :param df: dataframe of one (commodity, market, exchange) partition
+    :return: (commodity, market, exchange) of the partition, as strings
+    """
+    return tuple(str(df[k].iloc[0]) for k in ['commodity', 'market', 'exchange'])
+
+
+def partition_single_curves(df):
+    """
+    :param df: cleaned dataframe of the commodities contract prices of one (commodity, market, exchange) partition
+    :return: (partition_key, single curves of the partition with the column names of the output table)
+    """
+    return partition_key(df), forward_curve_output(name_contracts(single_curve_table(df), 'single_curve'))
+
+
+def partition_mixed_curves(df):
+    """
+    :param df: cleaned dataframe of the commodities contract prices of one (commodity, market, exchange) partition
+    :return: (partition_key, mixed curves of the partition, shaped if SHAPE_MIXED_CURVE, with the column names of the output table)
+    """
+    mixed_curve = name_contracts(mixed_curve_table(df), 'mixed_curve')
+    if SHAPE_MIXED_CURVE:
+        mixed_curve = shape_mixed_curve(mixed_curve, df)
+    return partition_key(df), forward_curve_output(mixed_curve)
+
+
+def replacePartitionsInSQL(df, partitions, replace=None, table_name=None, max_workers=1, executor='thread'):
+    """
+    :param df: cleaned dataframe of commodities contract prices of the partitions
+    :param partitions: dataframe with columns tradeDate, commodity, market, exchange, one row per partition of df
+    :param replace: replace(table_name, delete_sql, tables, column_types) function, framework_replace by default.
+                    curve_writer.dbapi_replace(connection) runs the delete and the inserts of each partition in one transaction
+    :param table_name: output table, tb.commodity_price_forward_curve_table(tb.UNSYNCED) by default
+    :param max_workers: see iter_partitions
+    :param executor: see iter_partitions
+    :return: rows of partitions whose curves replaced the ones of the output table. Partitions failing to insert are
+             logged and left out. The building and the replacing of the partitions are reported as the
+             create_single_curves, create_mixed_curve and insertValuetoSQL stages
+    """
+    logger = get_logger()
+    replace = replace or framework_replace
+    table_name = table_name or tb.commodity_price_forward_curve_table(tb.UNSYNCED)
+    rows = {(str(p.commodity), str(p.market), str(p.exchange)): p for p in partitions.itertuples(index=False)}
+    single_curves = timed_generator('create_single_curves',
+                                    iter_partitions(partition_single_curves, df, max_workers, executor), len(df))
+    mixed_curves = timed_generator('create_mixed_curve',
+                                   iter_partitions(partition_mixed_curves, df, max_workers, executor), len(df))
+    insert_timer = StageTimer('insertValuetoSQL')
+    replaced, rows_out = [], 0
+    for (key, single_curve), (_, mixed_curve) in zip(single_curves, mixed_curves):
+        insert_timer.start()
+        try:
+            count = replace(table_name, partition_delete_sql(rows[key], table_name), [single_curve, mixed_curve],
+                            FORWARD_CURVE_COLUMNS)
+        except Exception:
+            logger.exception('Curves of %s not replaced, rebuilt by the next run' % '|'.join(key))
+            continue
+        finally:
+            insert_timer.stop()
+        replaced.append(rows[key])
+        rows_out += count
+        if SNAPSHOT_STORE:
+            curve_store.write_snapshot(single_curve, 'single_curve')
+            curve_store.write_snapshot(mixed_curve, 'mixed_curve')
+        logger.info('%s rows of the curves of %s inserted' % (count, '|'.join(key)))
+    next(mixed_curves, None)   # ends the mixed curve generator too, so that its stage is reported
+    insert_timer.record['rows_out'] = rows_out
+    insert_timer.report()
+    return pd.DataFrame(replaced, columns=partitions.columns)
+
+
+def select_partitions(df, partitions):
+    """
+    :param df: dataframe of commodities contract prices
+    :param partitions: dataframe with columns commodity, market, exchange
+    :return: rows of df belonging to one of the partitions
+    """
+    keys = ['commodity', 'market', 'exchange']
+    return df[pd.MultiIndex.from_frame(df[keys]).isin(pd.MultiIndex.from_frame(partitions[keys]))]
+
+
+def forward_curve_output(curve):
+    """
+    :param curve: single or mixed curve dataframe
+    :return: curve with the column names of the output table, without the modified fields
+    """
+    curve = curve.rename(columns={'dateIndex': 'utcTimeStamp',
+                                  'utcTimeStamp': 'utcTradeDate',
+                                  'contractType': 'contractType1',
+                                  'contractName': 'contractType2'})
+    return curve.drop(['days', 'month', 'quarter', 'season', 'year', 'contract', 'locTimeStamp', 'deliveryStart', 'deliveryEnd'],
+                      axis=1, errors='ignore')  # Dropping modified fields
 
 
 @DecorateErrorHandling
-def runMainFunction():
+def runMainFunction(replace=None):
     """
     a pipeline to parse data through functions created.
     Finally appends to the database the forward curves for each commodity
+    :param replace: see output_replace
     :return:
     """
     runTimeController = current_thread().getRunTimeController()
     logger = runTimeController.logger.getLogger()
     tbl_dict = getTablesName()
     df = getsqldata(tbl_dict)
+    if SNAPSHOT_STORE:
+        curve_store.write_snapshot(df, 'contracts')
 
     df.dropna(subset=['deliveryStart', 'deliveryEnd'], inplace=True)
     df = fill_month_quarter_values(df) #creating fields for better parsing of data
     df = clean_data(df)
     #df.to_csv(r"C:\workspace\pycharm_projects\trunk\Paula_Python\src\Carbon\PersonalFolder\BernardR\test_data.csv",index=None, header=True)
-    single_curve = create_single_curves(df)
-    mixed_curve = create_mixed_curve(df)
-    single_curve.rename(columns={'dateIndex': 'utcTimeStamp',
-                       'utcTimeStamp': 'utcTradeDate',
-                       'contractType': 'contractType1',
-                       'contractName': 'contractType2'}, inplace=True)
-    mixed_curve.rename(columns={'dateIndex': 'utcTimeStamp',
-                                 'utcTimeStamp': 'utcTradeDate',
-                                 'contractType': 'contractType1',
-                                 'contractName': 'contractType2'}, inplace=True)
-    single_curve.drop(['days', 'month', 'quarter', 'season', 'year', 'contract', 'locTimeStamp', 'deliveryStart', 'deliveryEnd'],
-            inplace=True, axis=1, errors='ignore')  # Dropping modified fields
-    mixed_curve.drop(
-        ['days', 'month', 'quarter', 'season', 'year', 'contract', 'locTimeStamp', 'deliveryStart', 'deliveryEnd'],
-        inplace=True, axis=1, errors='ignore')
-    insertValuetoSQL(single_curve)
-    insertValuetoSQL(mixed_curve)
+    if INCREMENTAL_REBUILD:
+        fingerprints = partition_fingerprints(df, build_configuration())
+        partitions = dirty_partitions(fingerprints, load_fingerprints())
+        logger.info('%s of %s partitions changed since last run' % (len(partitions), len(fingerprints)))
+        df = select_partitions(df, partitions)
+    else:
+        partitions = partition_fingerprints(df)
+
+    # curves are built partition by partition, each one replacing the curves of its trade date in the output table
+    with output_replace(replace) as replace:
+        replaced = replacePartitionsInSQL(df, partitions, replace, max_workers=CURVE_WORKERS, executor=CURVE_EXECUTOR)
+    if len(replaced) < len(partitions):
+        logger.error('%s of %s partitions could not be inserted' % (len(partitions) - len(replaced), len(partitions)))
+    if INCREMENTAL_REBUILD:
+        save_fingerprints(replaced)
     logger.info('All data from tblpr commodity has been finished')
 
 
+def build_configuration():
+    """
+    :return: settings changing the built curves, part of the partition fingerprints
+    """
+    configuration = {'shape_mixed_curve': SHAPE_MIXED_CURVE}
+    if SHAPE_MIXED_CURVE:
+        configuration.update(smoothness=curve_shaping.SMOOTHNESS, constraint_weight=curve_shaping.CONSTRAINT_WEIGHT)
+    return configuration
+
+
+def build_snapshot(df):
+    """
+    :param df: commodities contract prices of one trade date
+    :return: (partitions of the trade date, single curves, mixed curves), curves with the column names of the output table
+    """
+    trade_date = df.utcTimeStamp.max().normalize()
+    df = df.dropna(subset=['deliveryStart', 'deliveryEnd'])
+    df = fill_month_quarter_values(df)
+    df = clean_data(df, as_of=trade_date)
+    single_curve = forward_curve_output(create_single_curves(df))
+    mixed_curve = create_mixed_curve(df, as_of=trade_date)
+    if SHAPE_MIXED_CURVE:
+        mixed_curve = shape_mixed_curve(mixed_curve, df)
+    mixed_curve = forward_curve_output(mixed_curve)
+    return partition_fingerprints(df, build_configuration()), single_curve, mixed_curve
+
+
+@DecorateErrorHandling
+def runBackfill(start_date, end_date, max_workers=CURVE_WORKERS, executor=CURVE_EXECUTOR, chunk_days=None, replace=None):
+    """
+    Rebuilds the single and mixed curves of every trade date between start_date and end_date:
+    the contracts are retrieved with one ranged query (getsqldata_range), then each trade date snapshot
+    is built by a pool worker. Curves of a trade date replace the ones already in the output table
+    :param start_date: first trade date, ex. '2019-01-01'
+    :param end_date: last trade date (included)
+    :param max_workers: number of snapshots built in parallel, 1 builds them one after the other
+    :param executor: 'process' or 'thread' pool
+    :param chunk_days: see getsqldata_range
+    :param replace: see output_replace
+    :return:
+    """
+    runTimeController = current_thread().getRunTimeController()
+    logger = runTimeController.logger.getLogger()
+    table_name = tb.commodity_price_forward_curve_table(tb.UNSYNCED)
+    df = getsqldata_range(start_date, end_date, chunk_days)
+    snapshots = [snapshot for _, snapshot in df.groupby(df.utcTimeStamp.dt.normalize(), sort=True)]
+    logger.info('%s trade dates retrieved between %s and %s' % (len(snapshots), start_date, end_date))
+
+    pool = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    with pool(max_workers=max_workers) as workers, output_replace(replace) as replace:
+        results = map(build_snapshot, snapshots) if max_workers == 1 else workers.map(build_snapshot, snapshots)
+        # inserts stay in this thread, one trade date after the other
+        for partitions, single_curve, mixed_curve in results:
+            failed = 0
+            # each curve is split once by partition, then looked up
+            curves = [partition_tables(curve) for curve in (single_curve, mixed_curve)]
+            for partition in partitions.itertuples(index=False):
+                key = (str(partition.commodity), str(partition.market), str(partition.exchange))
+                tables = [tables.get(key, curve.iloc[:0]) for tables, curve in zip(curves, (single_curve, mixed_curve))]
+                try:
+                    replace(table_name, partition_delete_sql(partition, table_name), tables, FORWARD_CURVE_COLUMNS)
+                except Exception:
+                    logger.exception('Curves of %s|%s|%s not replaced' % (partition.commodity, partition.market, partition.exchange))
+                    failed += 1
+            if SNAPSHOT_STORE:
+                curve_store.write_snapshot(single_curve, 'single_curve')
+                curve_store.write_snapshot(mixed_curve, 'mixed_curve')
+            logger.info('Curves of trade date %s inserted, %s partitions failed' % (partitions.tradeDate.max(), failed))
+    logger.info('Backfill from %s to %s has been finished' % (start_date, end_date))
+
+
 @DecorateErrorHandling
 def starttest():
     debugMode = True
@@ -0,0 +1,176 @@
+
+import functools
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from curve_segments import MIXED_KEYS
+import curve_calendar
+
+"""
+@summary:
+Aggregation of the daily curves (create_single_curves / create_mixed_curve output) back to strips:
+month, quarter, season and year averages of every curve in one pass.
+    1. the strips carry the features fill_month_quarter_values gives to the contract delivering them,
+       so they join back on the contracts: month (year, month), quarter (year, quarter), season ('winter2020':
+       Oct 2020 to Mar 2021), year (year)
+    2. period_calendar numbers the strips of a range of whole years once, the code of each day being an array
+       lookup. Calendars and weights are cached per (first year, last year), shared by the curves and calls
+    3. averages are weighted per day by a load profile, base (24h every day) or peak (12h on weekdays),
+       or any function of the days, and by the volume of the contract of the day for the volume-weighted price
+
+    strip_averages(create_mixed_curve(df), 'quarter', weighting='peak')
+"""
+
+#Number of calendars and weights kept in memory
+PERIOD_CACHE_SIZE = 32
+
+#Features identifying the strips of each period, as set by fill_month_quarter_values on the contracts
+PERIOD_COLUMNS = {'month': ['year', 'month'],
+                  'quarter': ['year', 'quarter'],
+                  'season': ['season'],
+                  'year': ['year']}
+
+PeriodCalendar = namedtuple('PeriodCalendar', ['first_day', 'codes', 'periods'])
+
+
+def base_load(days):
+    """
+    :param days: DatetimeIndex
+    :return: hours of the base load profile on each day
+    """
+    return np.full(len(days), 24.0)
+
+
+def peak_load(days):
+    """
+    :param days: DatetimeIndex
+    :return: hours of the peak load profile on each day, 8:00 to 20:00 on weekdays
+    """
+    return np.where(days.dayofweek < 5, 12.0, 0.0)
+
+
+def offpeak_load(days):
+    """
+    :param days: DatetimeIndex
+    :return: hours of the base load profile outside of the peak hours
+    """
+    return base_load(days) - peak_load(days)
+
+
+WEIGHTINGS = {'base': base_load, 'peak': peak_load, 'offpeak': offpeak_load}
+
+
+def calendar_days(first_year, last_year):
+    """
+    :return: days from the 1st of October before first_year to the 31st of March after last_year,
+             so that the strips of the years are whole, the winters crossing the years included
+    """
+    return curve_calendar.date_index('%s-10-01' % (first_year - 1), '%s-03-31' % (last_year + 1))
+
+
+def day_features(days):
+    """
+    :param days: DatetimeIndex
+    :return: dataframe of the features of the strips delivering each day: year, month, quarter, season
+    """
+    month = days.month.values
+    winter = (month >= 10) | (month <= 3)
+    season_year = days.year.values - (month <= 3)
+    return pd.DataFrame({'year': days.year.values,
+                         'month': month,
+                         'quarter': (month - 1) // 3 + 1,
+                         'season': np.where(winter, 'winter', 'summer').astype(object) + season_year.astype(str).astype(object)})
+
+
+@functools.lru_cache(maxsize=PERIOD_CACHE_SIZE)
+def period_calendar(first_year, last_year, period):
+    """
+    :param first_year: first year of the calendar
+    :param last_year: last year of the calendar
+    :param period: 'month', 'quarter', 'season' or 'year'
+    :return: PeriodCalendar(first_day, codes, periods): code of the strip of each day from first_day (read-only array),
+             periods dataframe of the strips in chronological order: features, periodStart, periodEnd, period_days
+    """
+    days = calendar_days(first_year, last_year)
+    features = day_features(days)[PERIOD_COLUMNS[period]]
+    change = np.ones(len(days), dtype=bool)
+    change[1:] = (features.values[1:] != features.values[:-1]).any(axis=1)
+    codes = np.cumsum(change) - 1
+    starts = np.flatnonzero(change)
+    ends = np.append(starts[1:], len(days)) - 1
+    periods = features.iloc[starts].reset_index(drop=True)
+    periods['periodStart'] = days[starts]
+    periods['periodEnd'] = days[ends]
+    periods['period_days'] = ends - starts + 1
+    codes.setflags(write=False)
+    return PeriodCalendar(days[0], codes, periods)
+
+
+@functools.lru_cache(maxsize=PERIOD_CACHE_SIZE)
+def calendar_weights(first_year, last_year, weighting):
+    """
+    :param weighting: name of a load profile of WEIGHTINGS
+    :return: read-only array of the weight of each day of calendar_days(first_year, last_year)
+    """
+    weights = WEIGHTINGS[weighting](calendar_days(first_year, last_year)).astype(float)
+    weights.setflags(write=False)
+    return weights
+
+
+def strip_averages(curve, period='month', keys=MIXED_KEYS, weighting='base', date_column='dateIndex'):
+    """
+    :param curve: daily curves, ex. output of create_mixed_curve (keys=MIXED_KEYS) or create_single_curves (keys=SINGLE_KEYS)
+    :param period: 'month', 'quarter', 'season' or 'year'
+    :param keys: columns identifying one curve
+    :param weighting: 'base', 'peak', 'offpeak' or a function of a DatetimeIndex returning the weight of each day
+    :param date_column: day of the rows
+    :return: dataframe with one row per (curve, strip) delivered by the curve: keys, strip features, periodStart, periodEnd,
+             days (priced days of the strip), period_days, complete (every day of the strip priced),
+             price (weighted by the load profile) and volume_weighted_price (weighted by the load profile times
+             the volume of the contract of the day, nan without volume)
+    """
+    days = pd.to_datetime(curve[date_column]).values.astype('datetime64[D]')
+    if len(curve) == 0:
+        periods = period_calendar(1970, 1970, period).periods.iloc[:0]   # dtypes of the strip columns
+        result = pd.concat([curve[list(keys)].reset_index(drop=True), periods.drop('period_days', axis=1)], axis=1)
+        return result.assign(days=np.zeros(0, dtype=np.int64), period_days=np.zeros(0, dtype=np.int64),
+                             complete=np.zeros(0, dtype=bool), price=np.zeros(0), volume_weighted_price=np.zeros(0))
+    first_year = int(str(days.min())[:4])
+    last_year = int(str(days.max())[:4])
+    calendar = period_calendar(first_year, last_year, period)
+    if callable(weighting):
+        weights = np.asarray(weighting(calendar_days(first_year, last_year)), dtype=float)
+    else:
+        weights = calendar_weights(first_year, last_year, weighting)
+
+    offset = (days - np.datetime64(calendar.first_day, 'D')).astype(np.int64)
+    hubs = curve.groupby(list(keys), sort=True, observed=True)
+    hub = hubs.ngroup().values
+    code = calendar.codes[offset]
+    groups, group = np.unique(hub.astype(np.int64) * len(calendar.periods) + code, return_inverse=True)
+
+    price = curve.price.values.astype(float)
+    priced = ~np.isnan(price)
+    weight = np.where(priced, weights[offset], 0.0)
+    value = np.where(priced, price, 0.0)
+    volume = curve.volume.values.astype(float) if 'volume' in curve.columns else np.full(len(curve), np.nan)
+    volume_weight = np.where(priced & ~np.isnan(volume), weight * np.nan_to_num(volume), 0.0)
+
+    count = len(groups)
+    total_weight = np.bincount(group, weight, count)
+    total_volume_weight = np.bincount(group, volume_weight, count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average = np.bincount(group, weight * value, count) / total_weight
+        volume_average = np.bincount(group, volume_weight * value, count) / total_volume_weight
+
+    first_row = np.zeros(count, dtype=np.int64)
+    first_row[group[::-1]] = np.arange(len(curve))[::-1]   # first row of each group
+    result = curve[list(keys)].iloc[first_row].reset_index(drop=True)
+    periods = calendar.periods.iloc[groups % len(calendar.periods)].reset_index(drop=True)
+    result = pd.concat([result, periods.drop('period_days', axis=1)], axis=1)
+    result['days'] = np.bincount(group, priced, count).astype(np.int64)
+    result['period_days'] = periods.period_days.values
+    result['complete'] = result.days.values == result.period_days.values
+    result['price'] = average
+    result['volume_weighted_price'] = volume_average
+    return result
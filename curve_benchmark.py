@@ -0,0 +1,499 @@
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import pandas as pd
+import numpy as np
+import warnings
+import commodities_futures_curve as cfc
+import full_year_price_curve as fyc
+import curve_segments
+import curve_shaping
+import curve_aggregation
+warnings.filterwarnings("ignore")
+
+"""
+@summary:
+Benchmark of the forward curve builders of commodities_futures_curve.py.
+    Input is the cleaned contract dataframe (output of fill_month_quarter_values + clean_data),
+    dumped to csv with df.to_csv(path, index=None, header=True).
+
+    python curve_benchmark.py <cleaned_contracts.csv>
+
+    Without a database, the pipeline stages are measured on synthetic contract universes of several sizes,
+    one json line per (scale, stage) appended to a results file to compare commits:
+
+    python curve_benchmark.py --scales [benchmark_results.jsonl]
+
+    Arbitrage-free shaping of the mixed curves (curve_shaping) on a synthetic universe, 200 hubs x 5 years by default:
+
+    python curve_benchmark.py --shaping [hubs] [years]
+"""
+
+#Trade date of the synthetic contracts, fixed so the results do not depend on the day of the run
+TRADE_DATE = '2020-01-02'
+
+#(hubs, years) of the synthetic contract universes of benchmark_scales
+SCALES = [(10, 2), (50, 3), (200, 5)]
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results.jsonl')
+
+HUB_ATTRIBUTES = [('power', 'eex', 'EUR', 'MWh'), ('gas', 'ice', 'EUR', 'MWh'), ('coal', 'ice', 'USD', 't'),
+                  ('carbon', 'eex', 'EUR', 't'), ('oil', 'ice', 'USD', 'bbl'), ('power', 'nasdaq', 'EUR', 'MWh')]
+
+
+def load_contracts(path):
+    """
+    :param path: csv dump of the cleaned commodities contract prices
+    :return: dataframe of commodities contract prices, as passed to create_single_curves
+    """
+    return cfc.apply_schema(pd.read_csv(path))
+
+
+def contract_calendar(trade_date, years):
+    """
+    :param trade_date: trade date of the contracts
+    :param years: number of delivery years from the year of trade_date
+    :return: list of (contractType, contractName, deliveryStart, deliveryEnd) traded on trade_date by one hub:
+             days and weekends of the next week, weeks of the next month, then months, quarters, seasons
+             and years over the delivery years
+    """
+    trade_date = pd.Timestamp(trade_date)
+    first_year = trade_date.year
+    contracts = []
+    for day in pd.date_range(trade_date + pd.Timedelta(days=1), periods=7):
+        if day.dayofweek < 5:
+            contracts.append(('Day', day.strftime('Day %d-%b-%y'), day, day))
+        elif day.dayofweek == 5:
+            contracts.append(('Weekend', day.strftime('WkEnd %d-%b-%y'), day, day + pd.Timedelta(days=1)))
+    for monday in pd.date_range(trade_date + pd.Timedelta(days=1), periods=4, freq='W-MON'):
+        contracts.append(('Week', monday.strftime('Wk %W-%y'), monday, monday + pd.Timedelta(days=6)))
+    for start in pd.date_range('%s-01-01' % first_year, periods=12 * years, freq='MS'):
+        contracts.append(('Month', start.strftime('%b-%y'), start, start + pd.offsets.MonthEnd(0)))
+    for start in pd.date_range('%s-01-01' % first_year, periods=4 * years, freq='QS'):
+        contracts.append(('Quarter', 'Q%s-%s' % (start.quarter, start.strftime('%y')), start, start + pd.offsets.QuarterEnd(0)))
+    for year in range(first_year, first_year + years):
+        contracts.append(('Season', 'Sum-%s' % year, pd.Timestamp(year, 4, 1), pd.Timestamp(year, 9, 30)))
+        contracts.append(('Season', 'Win-%s' % year, pd.Timestamp(year, 10, 1), pd.Timestamp(year + 1, 3, 31)))
+        contracts.append(('Year', 'Cal-%s' % year, pd.Timestamp(year, 1, 1), pd.Timestamp(year, 12, 31)))
+    return contracts
+
+
+def synthetic_contracts(hubs=10, years=2, trade_date=TRADE_DATE, zero_volume=0.3, seed=0):
+    """
+    :param hubs: number of (commodity, market, exchange) hubs
+    :param years: number of delivery years per hub
+    :param trade_date: trade date of the contracts
+    :param zero_volume: share of contracts without traded volume
+    :param seed: random seed, the same arguments always give the same contracts
+    :return: dataframe of commodities contract prices with the columns and dtypes of getsqldata
+    """
+    rng = np.random.RandomState(seed)
+    contracts = contract_calendar(trade_date, years)
+    count = hubs * len(contracts)
+    hub = np.repeat(np.arange(hubs), len(contracts))
+    attributes = [HUB_ATTRIBUTES[h % len(HUB_ATTRIBUTES)] for h in hub]
+    contract = [contracts[i] for i in np.tile(np.arange(len(contracts)), hubs)]
+
+    price = np.round(rng.uniform(20, 80, hubs)[hub] * rng.uniform(0.8, 1.2, count), 2)
+    spread = price * rng.uniform(0, 0.05, count)
+    low, high = np.round(price - spread, 2), np.round(price + spread, 2)
+    volume = np.where(rng.uniform(size=count) < zero_volume, 0, rng.randint(1, 5000, count))
+    timestamp = pd.Timestamp(trade_date) + pd.Timedelta(hours=17)
+    records = [(a[0], 'hub%03d' % h, a[1], a[2], a[3], c[0], c[1], timestamp, timestamp, p, l, hi, l, oi, v, c[2], c[3])
+               for h, a, c, p, l, hi, oi, v in zip(hub, attributes, contract, price, low, high, rng.randint(0, 20000, count), volume)]
+    return cfc.contracts_from_records(records)
+
+
+def same_curves(a, b, keys, shared_days=False):
+    """
+    :param a: forward curve dataframe (reference)
+    :param b: forward curve dataframe
+    :param keys: columns identifying one curve
+    :param shared_days: compare only the (curve, day) rows present in a.
+                        create_mixed_curve_loop drops the filled days that are identical in several curves
+    :return: True if both dataframes hold the same rows, irrespective of row order and dtypes
+    """
+    # the contract by contract builders index the days with 'YYYY-MM-DD' strings, the vectorized ones with datetime64
+    a, b = a.assign(dateIndex=pd.to_datetime(a.dateIndex)), b.assign(dateIndex=pd.to_datetime(b.dateIndex))
+    if shared_days:
+        b = b.merge(a[keys + ['dateIndex']], on=keys + ['dateIndex'])[list(b.columns)]
+    if list(a.columns) != list(b.columns) or len(a) != len(b):
+        return False
+    a = a.astype(str).sort_values(keys + ['dateIndex']).reset_index(drop=True)
+    b = b.astype(str).sort_values(keys + ['dateIndex']).reset_index(drop=True)
+    return a.equals(b)
+
+
+def dump_trade_date(df):
+    """
+    :param df: dataframe of commodities contract prices
+    :return: last trade date of the contracts, as_of of the mixed curves built from them
+    """
+    return pd.to_datetime(df.utcTimeStamp).max().normalize()
+
+
+def time_function(function, df, repeat=3):
+    """
+    :param function: curve builder, called as function(df.copy())
+    :param df: dataframe of commodities contract prices
+    :param repeat: number of runs, the fastest is kept
+    :return: (best wall time in seconds, output of the last run)
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        data = df.copy()
+        start = time.perf_counter()
+        result = function(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def peak_memory(function, df):
+    """
+    :param function: curve builder, called as function(df.copy()). Generators are consumed one partition at a time
+    :param df: dataframe of commodities contract prices
+    :return: (wall time in seconds, peak traced memory in MiB, number of output rows)
+    """
+    data = df.copy()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(data)
+    rows = len(result) if isinstance(result, pd.DataFrame) else sum(len(table) for table in result)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return round(elapsed, 4), round(peak / 2 ** 20, 1), rows
+
+
+def benchmark_builders(df, as_of=None):
+    """
+    :param df: dataframe of commodities contract prices
+    :param as_of: trade date of the mixed curves, last trade date of df by default
+    :return: dict of (seconds, peak MiB, rows) of each builder, concatenated in memory or streamed by partition
+    """
+    as_of = as_of or dump_trade_date(df)
+    return {'single_loop': peak_memory(lambda d: cfc.create_single_curves(d, vectorized=False), df),
+            'single': peak_memory(cfc.create_single_curves, df),
+            'single_stream': peak_memory(cfc.iter_single_curves, df),
+            'mixed_loop': peak_memory(lambda d: cfc.create_mixed_curve(d, vectorized=False, as_of=as_of), df),
+            'mixed': peak_memory(lambda d: cfc.create_mixed_curve(d, as_of=as_of), df),
+            'mixed_stream': peak_memory(lambda d: cfc.iter_mixed_curves(d, as_of=as_of), df)}
+
+
+def fill_month_quarter_values_rowwise(df):
+    """
+    :param df: dataframe of commodities contract prices
+    :return: same features as cfc.fill_month_quarter_values, built value by value (former implementation, reference)
+    """
+    df['days'] = [d.days + 1 for d in df.deliveryEnd - df.deliveryStart]
+    df['month'] = df['deliveryStart'].dt.month
+    df['quarter'] = df['month'].apply(lambda month: (month - 1) // 3 + 1)
+    df['year'] = df['deliveryStart'].dt.year
+    df['season'] = [('winter' + str(x.year)) if x.month in [10, 11, 12, 1, 2, 3] else 'summer' + str(x.year) for x in df['deliveryStart'].dropna()]
+    df['contract'] = df['contractType'].astype(object).apply(cfc.contract_type)
+    return df
+
+
+def benchmark_features(df, rows=1000000, repeat=3):
+    """
+    :param df: dataframe of commodities contract prices, repeated up to the number of rows
+    :param rows: number of input rows of the microbenchmark
+    :param repeat: number of runs per implementation
+    :return: dict with timings of the row-wise and the vectorized fill_month_quarter_values
+    """
+    df = df.take(np.arange(rows) % len(df)).reset_index(drop=True)
+    rowwise_time, _ = time_function(fill_month_quarter_values_rowwise, df, repeat)
+    vector_time, _ = time_function(cfc.fill_month_quarter_values, df, repeat)
+    return {'rows': rows,
+            'rowwise_seconds': round(rowwise_time, 4),
+            'vectorized_seconds': round(vector_time, 4),
+            'speedup': round(rowwise_time / vector_time, 1)}
+
+
+def curve_memory(df):
+    """
+    :param df: dataframe of commodities contract prices
+    :return: dict with the memory (MiB) per million expanded daily rows of the single curves, with the compact dtypes
+             of apply_schema and with the former representation (object columns, dates and contract tiers as strings)
+    """
+    curve = cfc.create_single_curves(df.copy())
+    legacy = curve.astype(object)
+    for column in ['dateIndex', 'deliveryStart', 'deliveryEnd']:
+        legacy[column] = curve[column].dt.strftime("%Y-%m-%d").astype(object)
+    per_million = 1e6 / len(curve) / 2 ** 20
+    compact_size = curve.memory_usage(deep=True).sum() * per_million
+    legacy_size = legacy.memory_usage(deep=True).sum() * per_million
+    return {'rows': len(curve),
+            'compact_mib_per_million_rows': round(compact_size, 1),
+            'object_mib_per_million_rows': round(legacy_size, 1),
+            'reduction': round(legacy_size / compact_size, 1)}
+
+
+def segment_memory(df, as_of=None):
+    """
+    :param df: dataframe of commodities contract prices
+    :param as_of: trade date of the mixed curve, last trade date of df by default
+    :return: dict with rows and memory (MiB) of the daily curves and of their segments (curve_segments),
+             and whether the segments expand back to the daily curves
+    """
+    as_of = as_of or dump_trade_date(df)
+    results = {}
+    for name, curve, keys in [('single', cfc.create_single_curves(df.copy()), curve_segments.SINGLE_KEYS),
+                              ('mixed', cfc.create_mixed_curve(df.copy(), as_of=as_of), curve_segments.MIXED_KEYS)]:
+        segments = curve_segments.curve_segments(curve, keys)
+        daily_size = curve.memory_usage(deep=True).sum() / 2 ** 20
+        segment_size = segments.memory_usage(deep=True).sum() / 2 ** 20
+        expanded = curve_segments.expand_segments(segments, keys=keys)[list(curve.columns)]
+        results[name] = {'rows': len(curve),
+                         'segments': len(segments),
+                         'daily_mib': round(daily_size, 2),
+                         'segment_mib': round(segment_size, 2),
+                         'reduction': round(daily_size / segment_size, 1),
+                         'same_output': same_curves(curve.reset_index(drop=True), expanded, keys)}
+    return results
+
+
+def benchmark_single_curves(df, repeat=3):
+    """
+    :param df: dataframe of commodities contract prices
+    :param repeat: number of runs per path
+    :return: dict with timings of the row-by-row and the vectorized single curve builders
+    """
+    loop_time, loop_curve = time_function(lambda d: cfc.create_single_curves(d, vectorized=False), df, repeat)
+    vector_time, vector_curve = time_function(cfc.create_single_curves, df, repeat)
+    return {'contracts': len(df),
+            'rows': len(vector_curve),
+            'loop_seconds': round(loop_time, 4),
+            'vectorized_seconds': round(vector_time, 4),
+            'speedup': round(loop_time / vector_time, 1),
+            'same_output': same_curves(loop_curve, vector_curve, ['commodity', 'market', 'exchange', 'contract'])}
+
+
+def benchmark_mixed_curve(df, repeat=3, as_of=None):
+    """
+    :param df: dataframe of commodities contract prices
+    :param repeat: number of runs per path
+    :param as_of: trade date of the mixed curves, last trade date of df by default
+    :return: dict with timings of the contract by contract and the vectorized mixed curve builders
+    """
+    as_of = as_of or dump_trade_date(df)
+    loop_time, loop_curve = time_function(lambda d: cfc.create_mixed_curve(d, vectorized=False, as_of=as_of), df, repeat)
+    vector_time, vector_curve = time_function(lambda d: cfc.create_mixed_curve(d, as_of=as_of), df, repeat)
+    return {'contracts': len(df),
+            'rows': len(vector_curve),
+            'loop_seconds': round(loop_time, 4),
+            'vectorized_seconds': round(vector_time, 4),
+            'speedup': round(loop_time / vector_time, 1),
+            'same_output': same_curves(loop_curve, vector_curve, ['commodity', 'market', 'exchange'], shared_days=True)}
+
+
+def append_rows_rowwise(df, newTable):
+    """
+    :param df: historical data indexed by date
+    :param newTable: output of fyc.build_date_index
+    :return: same as fyc.append_rows(df, newTable), copied row by row (former implementation, reference)
+    """
+    for index, row in df.iterrows():
+        newTable.loc[index] = list(row)
+    newTable = newTable.fillna(method='ffill').fillna(method='bfill')
+    return newTable
+
+
+def benchmark_append_rows(year=2019, repeat=3, seed=0):
+    """
+    :param year: calendar year of the full year curve
+    :param repeat: number of runs per implementation
+    :param seed: random seed of the synthetic historical prices
+    :return: dict with timings of the row-by-row and the reindexed gap fill of a daily price series published on
+             business days with missing days, and whether both fill the calendar with the same values
+    """
+    rng = np.random.RandomState(seed)
+    days = pd.bdate_range('%s-01-01' % year, '%s-12-31' % year)
+    days = days[rng.uniform(size=len(days)) > 0.1]
+    df = pd.DataFrame({'commodity': 'gas', 'market': 'ttf', 'contractName': 'day-ahead', 'utcTimeStamp': days,
+                       'price': np.round(rng.uniform(10, 30, len(days)), 2)})
+    df.index = days.strftime("%Y-%m-%d")
+    calendar = pd.date_range('%s-01-01' % year, days.max())
+
+    def empty_table():
+        return pd.DataFrame(columns=df.columns, index=calendar)
+    rowwise_time, rowwise = time_function(lambda d: append_rows_rowwise(d, empty_table()), df, repeat)
+    reindex_time, reindexed = time_function(lambda d: fyc.append_rows(d, empty_table()), df, repeat)
+    return {'rows': len(calendar),
+            'rowwise_seconds': round(rowwise_time, 4),
+            'reindex_seconds': round(reindex_time, 4),
+            'speedup': round(rowwise_time / reindex_time, 1),
+            'same_output': rowwise.astype(object).equals(reindexed.astype(object))}
+
+
+def benchmark_shaping(hubs=200, years=5, repeat=3):
+    """
+    :param hubs: number of hubs of the synthetic contracts
+    :param years: number of delivery years per hub
+    :param repeat: number of runs, the fastest is kept
+    :return: dict with the size of the sparse system, the time of the shaping of all the mixed curves at once,
+             and the mean/max absolute difference between the contract prices and the average of the curve over
+             their delivery days, stitched and shaped. Synthetic prices are drawn independently, overlapping
+             quotes contradict each other and the shaped residuals are the least squares compromise
+    """
+    df = cfc.clean_data(cfc.fill_month_quarter_values(synthetic_contracts(hubs, years)), as_of=TRADE_DATE)
+    mixed = cfc.create_mixed_curve(df.copy(), as_of=TRADE_DATE)
+    contracts = cfc.shaping_contracts(df)
+    seconds, shaped = time_function(lambda d: curve_shaping.shape_curves(d, contracts), mixed, repeat)
+    stitched_residuals = curve_shaping.strip_residuals(mixed, contracts).residual.abs()
+    shaped_residuals = curve_shaping.strip_residuals(shaped, contracts).residual.abs()
+    return {'hubs': hubs,
+            'years': years,
+            'days': len(mixed),
+            'contracts': len(contracts),
+            'seconds': round(seconds, 4),
+            'stitched_residual_mean': round(stitched_residuals.mean(), 4),
+            'stitched_residual_max': round(stitched_residuals.max(), 4),
+            'shaped_residual_mean': round(shaped_residuals.mean(), 4),
+            'shaped_residual_max': round(shaped_residuals.max(), 4)}
+
+
+def strip_averages_groupby(curve, period, keys):
+    """
+    :param curve: daily curves
+    :param period: 'month', 'quarter', 'season' or 'year'
+    :param keys: columns identifying one curve
+    :return: base load and volume-weighted averages of the strips with a group-by on the day features (reference)
+    """
+    curve = curve.reset_index(drop=True)
+    features = curve_aggregation.day_features(pd.DatetimeIndex(curve.dateIndex))[curve_aggregation.PERIOD_COLUMNS[period]]
+    table = pd.concat([curve[keys + ['price', 'volume']], features], axis=1)
+    table['price'] = table.price.astype(float)
+    table['volume_price'] = table.price * table.volume
+    grouped = table.groupby(keys + list(features.columns), observed=True)
+    result = grouped.agg(price=('price', 'mean'), volume_price=('volume_price', 'sum'), volume=('volume', 'sum'))
+    result['volume_weighted_price'] = result.volume_price / result.volume
+    return result[['price', 'volume_weighted_price']].reset_index()
+
+
+def benchmark_strip_averages(df, repeat=3, as_of=None):
+    """
+    :param df: dataframe of commodities contract prices
+    :param repeat: number of runs per implementation
+    :param as_of: trade date of the mixed curve, last trade date of df by default
+    :return: dict per (curve, period) with timings of the group-by and of curve_aggregation.strip_averages,
+             and whether both give the same averages
+    """
+    as_of = as_of or dump_trade_date(df)
+    results = {}
+    for name, curve, keys in [('single', cfc.create_single_curves(df.copy()), curve_segments.SINGLE_KEYS),
+                              ('mixed', cfc.create_mixed_curve(df.copy(), as_of=as_of), curve_segments.MIXED_KEYS)]:
+        for period in curve_aggregation.PERIOD_COLUMNS:
+            groupby_time, reference = time_function(lambda d: strip_averages_groupby(d, period, keys), curve, repeat)
+            strip_time, strips = time_function(lambda d: curve_aggregation.strip_averages(d, period, keys), curve, repeat)
+            on = keys + curve_aggregation.PERIOD_COLUMNS[period]
+            both = reference.astype({k: str for k in keys}).merge(strips.astype({k: str for k in keys}), on=on)
+            results['%s_%s' % (name, period)] = {
+                'strips': len(strips),
+                'groupby_seconds': round(groupby_time, 4),
+                'strip_seconds': round(strip_time, 4),
+                'speedup': round(groupby_time / strip_time, 1),
+                'same_output': len(both) == len(strips) == len(reference) and
+                               np.allclose(both.price_x, both.price_y, atol=1e-4) and
+                               np.allclose(both.volume_weighted_price_x, both.volume_weighted_price_y, atol=1e-4, equal_nan=True)}
+    return results
+
+
+def current_commit():
+    """
+    :return: short hash of the checked out commit, None outside of a git checkout
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_stages(df, repeat=3):
+    """
+    :param df: dataframe of commodities contract prices, as returned by getsqldata
+    :param repeat: number of timed runs per stage, the fastest is kept. Peak memory is measured on one extra traced run
+    :return: list of dicts (stage, rows_in, rows_out, seconds, rows_per_second, peak_mib) of the pipeline stages,
+             each stage run on the output of the previous ones. rows_per_second counts the output (expanded) rows
+    """
+    featured = cfc.fill_month_quarter_values(df.copy())
+    cleaned = cfc.clean_data(featured.copy(), as_of=TRADE_DATE)
+    stages = [('fill_month_quarter_values', cfc.fill_month_quarter_values, df),
+              ('clean_data', lambda d: cfc.clean_data(d, as_of=TRADE_DATE), featured),
+              ('create_single_curves', cfc.create_single_curves, cleaned),
+              ('create_mixed_curve', lambda d: cfc.create_mixed_curve(d, as_of=TRADE_DATE), cleaned)]
+    results = []
+    for name, function, data in stages:
+        seconds, output = time_function(function, data, repeat)
+        peak = peak_memory(function, data)[1]
+        results.append({'stage': name,
+                        'rows_in': len(data),
+                        'rows_out': len(output),
+                        'seconds': round(seconds, 4),
+                        'rows_per_second': int(len(output) / seconds),
+                        'peak_mib': peak})
+    return results
+
+
+def benchmark_scales(scales=SCALES, repeat=3, path=RESULTS_FILE):
+    """
+    :param scales: list of (hubs, years) of the synthetic contract universes
+    :param repeat: number of timed runs per stage
+    :param path: results file, one json line per (scale, stage) is appended with the commit and the time of the run
+    :return: list of the appended results
+    """
+    run = {'commit': current_commit(), 'run_at': pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")}
+    results = []
+    for hubs, years in scales:
+        contracts = synthetic_contracts(hubs, years)
+        for result in benchmark_stages(contracts, repeat):
+            results.append(dict(run, hubs=hubs, years=years, **result))
+    with open(path, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result) + '\n')
+    return results
+
+
+def parse_arguments(arguments=None):
+    """
+    :param arguments: command line arguments, sys.argv[1:] by default
+    :return: argparse namespace of the usages of the module summary. Exits with the usage and status 2 if they are invalid
+    """
+    parser = argparse.ArgumentParser(description='Benchmark of the forward curve builders of commodities_futures_curve.py')
+    modes = parser.add_mutually_exclusive_group(required=True)
+    modes.add_argument('contracts', nargs='?', help='cleaned contracts csv (fill_month_quarter_values + clean_data output)')
+    modes.add_argument('--scales', nargs='?', const=RESULTS_FILE, metavar='RESULTS_FILE',
+                       help='stages on synthetic universes, json lines appended to RESULTS_FILE (%s by default)' % RESULTS_FILE)
+    modes.add_argument('--shaping', nargs='*', type=int, metavar='N',
+                       help='arbitrage-free shaping on a synthetic universe: [hubs] [years]')
+    namespace = parser.parse_args(arguments)
+    if namespace.shaping is not None and len(namespace.shaping) > 2:
+        parser.error('--shaping takes at most hubs and years')
+    return namespace
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    if arguments.scales is not None:
+        for result in benchmark_scales(path=arguments.scales):
+            print(result)
+        sys.exit()
+    if arguments.shaping is not None:
+        print(benchmark_shaping(*arguments.shaping))
+        sys.exit()
+    contracts = load_contracts(arguments.contracts)
+    print(benchmark_single_curves(contracts))
+    print(benchmark_mixed_curve(contracts))
+    print(benchmark_builders(contracts))
+    print(curve_memory(contracts))
+    print(segment_memory(contracts))
+    print(benchmark_strip_averages(contracts))
+    print(benchmark_features(contracts))
+    print(benchmark_append_rows())
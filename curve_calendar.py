@@ -0,0 +1,220 @@
+
+import functools
+from collections import namedtuple
+from dateutil.easter import easter
+import numpy as np
+import pandas as pd
+
+"""
+@summary:
+Calendar service shared by commodities_futures_curve.py and full_year_price_curve.py.
+    Date indices are built once per (start, end, kind, exchange) and then served from a cache.
+    The same immutable DatetimeIndex object is reused by every partition, commodity and curve year of the process.
+        kind='calendar'  every day
+        kind='business'  Monday to Friday
+        kind='trading'   business days without the holidays of the exchange
+    date_labels serves the 'YYYY-MM-DD' string index of the contract by contract builders the same way.
+    span gives the first and last date of a column in one pass, without sorting it.
+
+    Trading days of an exchange: weekdays without the holidays of its EXCHANGE_HOLIDAYS rules and the dates added
+    with register_holidays. trading_calendar precomputes, for every calendar day of a range of years, the position of
+    the last trading day on or before it, so that the lookups on arrays of dates are index arithmetic:
+        is_trading_day, previous_trading_day, add_trading_days   fills holding the last trading day values
+        front_months                                             front contract of each trade date, rolled on expiry
+"""
+
+#Number of date indices kept in memory
+CALENDAR_CACHE_SIZE = 256
+
+CALENDAR_KINDS = ('calendar', 'business', 'trading')
+
+#Holidays of each rule, as a function of the year
+HOLIDAY_RULES = {'new_year': lambda year: pd.Timestamp(year, 1, 1),
+                 'good_friday': lambda year: pd.Timestamp(easter(year)) - pd.Timedelta(days=2),
+                 'easter_monday': lambda year: pd.Timestamp(easter(year)) + pd.Timedelta(days=1),
+                 'labour_day': lambda year: pd.Timestamp(year, 5, 1),
+                 'christmas_eve': lambda year: pd.Timestamp(year, 12, 24),
+                 'christmas': lambda year: pd.Timestamp(year, 12, 25),
+                 'boxing_day': lambda year: pd.Timestamp(year, 12, 26),
+                 'new_year_eve': lambda year: pd.Timestamp(year, 12, 31)}
+
+#Holiday rules of the exchanges (lowercase as in the cleaned contracts), the regular closures of their energy futures.
+#   Exceptional closures are added with register_holidays
+EXCHANGE_HOLIDAYS = {'ice': ['new_year', 'good_friday', 'christmas', 'boxing_day'],
+                     'eex': ['new_year', 'good_friday', 'easter_monday', 'labour_day', 'christmas_eve', 'christmas',
+                             'boxing_day', 'new_year_eve']}
+
+#{exchange: DatetimeIndex of its additional holidays}, see register_holidays
+exchange_holidays = {}
+
+TradingCalendar = namedtuple('TradingCalendar', ['first_day', 'previous', 'days'])
+
+
+def span(values):
+    """
+    :param values: dates (series, index or array), NaT/None ignored
+    :return: (first date, last date) as Timestamps, (NaT, NaT) if there is no date
+    """
+    days = pd.to_datetime(pd.Series(values, copy=False)).values
+    days = days[~np.isnat(days)]
+    if len(days) == 0:
+        return pd.NaT, pd.NaT
+    return pd.Timestamp(days.min()), pd.Timestamp(days.max())
+
+
+def register_holidays(exchange, dates):
+    """
+    :param exchange: exchange name, lowercase as in the cleaned contracts
+    :param dates: holidays of the exchange
+    :return: the cached calendars are dropped, the trading calendars of the exchange exclude the dates from now on
+    """
+    exchange_holidays[exchange] = pd.DatetimeIndex(pd.to_datetime(list(dates))).normalize().unique().sort_values()
+    clear_cache()
+
+
+def holidays(exchange, first_year, last_year):
+    """
+    :param exchange: exchange name
+    :param first_year: first year of the holidays
+    :param last_year: last year of the holidays (included)
+    :return: sorted DatetimeIndex of the holidays of the exchange: its EXCHANGE_HOLIDAYS rules and the registered dates
+    """
+    days = [HOLIDAY_RULES[rule](year) for rule in EXCHANGE_HOLIDAYS.get(exchange, []) for year in range(first_year, last_year + 1)]
+    days = pd.DatetimeIndex(days).append(exchange_holidays.get(exchange, pd.DatetimeIndex([])))
+    return days[(days.year >= first_year) & (days.year <= last_year)].unique().sort_values()
+
+
+def day_key(value):
+    """
+    :return: 'YYYY-MM-DD' of a date, key of the cached indices
+    """
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
+
+
+@functools.lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def cached_index(start, end, kind, exchange):
+    if kind not in CALENDAR_KINDS:
+        raise ValueError('Unknown calendar kind %s' % kind)
+    days = pd.date_range(start=start, end=end)
+    if kind == 'calendar':
+        return days
+    days = days[days.dayofweek < 5]
+    if kind == 'trading' and exchange is not None:
+        days = days[~days.isin(holidays(exchange, days[0].year, days[-1].year))] if len(days) else days
+    return days
+
+
+@functools.lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def cached_labels(start, end):
+    return pd.Index(pd.date_range(start=start, end=end).strftime("%Y-%m-%d"))
+
+
+def date_index(start, end, kind='calendar', exchange=None):
+    """
+    :param start: first day
+    :param end: last day (included)
+    :param kind: 'calendar', 'business' or 'trading'
+    :param exchange: exchange of the holidays of a 'trading' calendar
+    :return: DatetimeIndex of the days, shared by every caller of the same arguments: do not modify it in place
+    """
+    return cached_index(day_key(start), day_key(end), kind, exchange if kind == 'trading' else None)
+
+
+def date_labels(start, end):
+    """
+    :param start: first day
+    :param end: last day (included)
+    :return: index of the days as 'YYYY-MM-DD' strings, shared by every caller of the same arguments
+    """
+    return cached_labels(day_key(start), day_key(end))
+
+
+@functools.lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def trading_calendar(first_year, last_year, exchange=None):
+    """
+    :param first_year: first year of the calendar
+    :param last_year: last year of the calendar (included)
+    :param exchange: exchange of the holidays, None for Monday to Friday
+    :return: TradingCalendar(first_day, previous, days), read-only arrays: days the trading days (datetime64[D]),
+             previous the position in days of the last trading day on or before each calendar day from first_day, -1 before the first
+    """
+    kind = 'trading' if exchange is not None else 'business'
+    days = date_index('%s-01-01' % first_year, '%s-12-31' % last_year, kind, exchange).values.astype('datetime64[D]')
+    first_day = np.datetime64('%s-01-01' % first_year, 'D')
+    trading = np.zeros((np.datetime64('%s-12-31' % last_year, 'D') - first_day).astype(np.int64) + 1, dtype=bool)
+    trading[(days - first_day).astype(np.int64)] = True
+    previous = np.cumsum(trading) - 1
+    previous.setflags(write=False)
+    days.setflags(write=False)
+    return TradingCalendar(first_day, previous, days)
+
+
+def calendar_positions(dates, exchange=None):
+    """
+    :param dates: dates (series, index or array)
+    :param exchange: exchange of the holidays, None for Monday to Friday
+    :return: (TradingCalendar covering the dates with a year of margin on both sides, days of the dates as datetime64[D],
+              position of the last trading day on or before each date)
+    """
+    days = pd.to_datetime(pd.Series(dates, copy=False)).values.astype('datetime64[D]')
+    years = days.astype('datetime64[Y]').astype(np.int64) + 1970
+    calendar = trading_calendar(int(years.min()) - 1, int(years.max()) + 1, exchange)
+    return calendar, days, calendar.previous[(days - calendar.first_day).astype(np.int64)]
+
+
+def is_trading_day(dates, exchange=None):
+    """
+    :param dates: dates (series, index or array)
+    :param exchange: exchange of the holidays, None for Monday to Friday
+    :return: boolean array, True on the trading days of the exchange
+    """
+    if len(dates) == 0:
+        return np.zeros(0, dtype=bool)
+    calendar, days, previous = calendar_positions(dates, exchange)
+    return calendar.days[previous] == days
+
+
+def add_trading_days(dates, count, exchange=None):
+    """
+    :param dates: dates (series, index or array)
+    :param count: number of trading days to add, negative to go back. A non trading date counts from the trading day before it
+    :param exchange: exchange of the holidays, None for Monday to Friday
+    :return: datetime64[D] array of the trading days
+    """
+    if len(dates) == 0:
+        return np.zeros(0, dtype='datetime64[D]')
+    calendar, _, previous = calendar_positions(dates, exchange)
+    return calendar.days[previous + count]
+
+
+def previous_trading_day(dates, exchange=None):
+    """
+    :param dates: dates (series, index or array)
+    :param exchange: exchange of the holidays, None for Monday to Friday
+    :return: datetime64[D] array of the last trading day on or before each date
+    """
+    return add_trading_days(dates, 0, exchange)
+
+
+def front_months(trade_dates, roll_offset, exchange=None):
+    """
+    :param trade_dates: trade dates (series, index or array)
+    :param roll_offset: months between the trade month and the delivery month of the front contract, ex. 2 for brent
+                        which trades the contract of March until the last trading day of January
+    :param exchange: exchange of the holidays, None for Monday to Friday
+    :return: datetime64[M] array of the delivery month of the front contract of each trade date. The contract of month M
+             expires on the last trading day of month M - roll_offset, the next one is the front contract after it
+    """
+    if len(trade_dates) == 0:
+        return np.zeros(0, dtype='datetime64[M]')
+    calendar, days, _ = calendar_positions(trade_dates, exchange)
+    trade_month = days.astype('datetime64[M]')
+    month_end = (trade_month + 1).astype('datetime64[D]') - 1
+    expiry = calendar.days[calendar.previous[(month_end - calendar.first_day).astype(np.int64)]]
+    return trade_month + roll_offset + (days > expiry).astype(np.int64)
+
+
+def clear_cache():
+    cached_index.cache_clear()
+    cached_labels.cache_clear()
+    trading_calendar.cache_clear()
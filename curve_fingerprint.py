@@ -0,0 +1,97 @@
+
+import hashlib
+import json
+import os
+import pandas as pd
+import numpy as np
+
+"""
+@summary:
+Change detection for the incremental rebuild of the forward curves.
+    1. every (trade date, commodity, market, exchange) partition of the cleaned contracts gets a fingerprint,
+       hash of the contract rows (delivery window, prices, volumes) independent of the row order,
+       and of the build configuration (ex. shaping of the mixed curves), so that a changed setting rebuilds every partition
+    2. fingerprints are compared with the ones stored by the previous run of the same trade date,
+       only the partitions whose fingerprint changed (or is new) have to be rebuilt
+    3. fingerprints are persisted in a json file for the partitions whose rebuilt curves are confirmed inserted
+"""
+
+FINGERPRINT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'curve_fingerprints.json')
+
+#Number of trade dates kept in the fingerprint file
+KEEP_TRADE_DATES = 10
+
+PARTITION_KEYS = ['tradeDate', 'commodity', 'market', 'exchange']
+
+#Input columns whose change modifies the built curves
+FINGERPRINT_COLUMNS = ['contractType', 'contractName', 'deliveryStart', 'deliveryEnd',
+                       'price', 'open', 'high', 'low', 'oi', 'volume']
+
+
+def partition_fingerprints(df, configuration=None):
+    """
+    :param df: cleaned dataframe of commodities contract prices
+    :param configuration: json serializable dict of the settings the curves are built with, part of every fingerprint
+    :return: dataframe with columns PARTITION_KEYS + ['fingerprint'], one row per partition.
+             tradeDate is the last DATE(utcTimeStamp) of the partition
+    """
+    rows = df[FINGERPRINT_COLUMNS].copy()
+    rows['deliveryStart'] = pd.to_datetime(rows.deliveryStart).dt.strftime("%Y-%m-%d")
+    rows['deliveryEnd'] = pd.to_datetime(rows.deliveryEnd).dt.strftime("%Y-%m-%d")
+    table = df[['commodity', 'market', 'exchange']].copy()
+    table['tradeDate'] = pd.to_datetime(df.utcTimeStamp).dt.strftime("%Y-%m-%d")
+    table['tradeDate'] = table.groupby(['commodity', 'market', 'exchange'], observed=True).tradeDate.transform('max')
+    table['row_hash'] = pd.util.hash_pandas_object(rows.astype(str), index=False).values
+
+    settings = json.dumps(configuration, sort_keys=True).encode() if configuration else b''
+
+    # sorted row hashes, so the fingerprint does not depend on the order the rows are retrieved in
+    fingerprints = table.groupby(PARTITION_KEYS, observed=True).row_hash.agg(
+        lambda h: hashlib.sha1(np.sort(h.values).tobytes() + settings).hexdigest())
+    return fingerprints.rename('fingerprint').reset_index()
+
+
+def fingerprint_key(row):
+    """
+    :param row: sequence of the PARTITION_KEYS values
+    :return: key of the partition in the fingerprint file
+    """
+    return '|'.join(str(value) for value in row)
+
+
+def load_fingerprints(path=FINGERPRINT_FILE):
+    """
+    :param path: fingerprint file
+    :return: dict {partition key: fingerprint} stored by the previous runs, empty if no file yet
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def dirty_partitions(fingerprints, stored):
+    """
+    :param fingerprints: output of partition_fingerprints for the current run
+    :param stored: output of load_fingerprints
+    :return: rows of fingerprints whose partition is new or changed since the stored run
+    """
+    keys = [fingerprint_key(row) for row in fingerprints[PARTITION_KEYS].values]
+    changed = [stored.get(key) != fingerprint for key, fingerprint in zip(keys, fingerprints.fingerprint)]
+    return fingerprints[np.array(changed, dtype=bool)]
+
+
+def save_fingerprints(fingerprints, path=FINGERPRINT_FILE):
+    """
+    :param fingerprints: fingerprints of the partitions inserted in the database
+    :param path: fingerprint file, updated in place. Only the last KEEP_TRADE_DATES trade dates are kept
+    :return:
+    """
+    stored = load_fingerprints(path)
+    stored.update({fingerprint_key(row[:-1]): row[-1] for row in fingerprints[PARTITION_KEYS + ['fingerprint']].values})
+    trade_dates = sorted(set(key.split('|')[0] for key in stored))[-KEEP_TRADE_DATES:]
+    stored = {key: value for key, value in stored.items() if key.split('|')[0] in trade_dates}
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(stored, f, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
@@ -0,0 +1,127 @@
+
+import numpy as np
+import pandas as pd
+
+"""
+@summary:
+Compact representation of the forward curves as piecewise-constant segments.
+    The curve builders give one row per day, a year contract is repeated on 365 rows with all its columns.
+    A segment holds the consecutive days of a curve which carry the same values:
+        keys (commodity, market, exchange [, contract]), start, end, price, contract metadata ...
+    1. curve_segments:  daily curve -> segments, iter_curve_segments streams the builders partition by partition
+                        so the daily rows of a single partition only are in memory
+    2. segment_index + price_at: lookup of the value of a curve on a date (binary search on the segment starts)
+    3. expand_segments: daily rows of the segments between two dates, same columns as the builders output
+"""
+
+#Columns identifying one curve of create_mixed_curve / create_single_curves
+MIXED_KEYS = ['commodity', 'market', 'exchange']
+SINGLE_KEYS = ['commodity', 'market', 'exchange', 'contract']
+
+
+def same_as_previous(values):
+    """
+    :param values: pandas series
+    :return: boolean array, True where the value equals the one of the previous row (nulls equal to nulls)
+    """
+    previous = values.shift()
+    same = (values == previous).values
+    return same | (values.isnull().values & previous.isnull().values)
+
+
+def curve_segments(curve, keys=MIXED_KEYS, date_column='dateIndex'):
+    """
+    :param curve: daily curve, output of create_mixed_curve (keys=MIXED_KEYS) or create_single_curves (keys=SINGLE_KEYS)
+    :param keys: columns identifying one curve
+    :param date_column: day of the rows
+    :return: dataframe of segments: keys, start, end, then the other columns of curve, one row per run of
+             consecutive days of a curve with identical values
+    """
+    curve = curve.sort_values(keys + [date_column]).reset_index(drop=True)
+    days = pd.to_datetime(curve[date_column]).values.astype('datetime64[D]').astype(np.int64)
+    values = [c for c in curve.columns if c != date_column]
+
+    continued = np.ones(len(curve), dtype=bool)
+    continued[1:] = days[1:] == days[:-1] + 1
+    for column in values:
+        continued &= same_as_previous(curve[column])
+    if len(curve):
+        continued[0] = False
+
+    starts = np.flatnonzero(~continued)
+    ends = np.append(starts[1:], len(curve))[:len(starts)] - 1
+    segments = curve.iloc[starts][values].reset_index(drop=True)
+    segments.insert(len(keys), 'start', curve[date_column].values[starts])
+    segments.insert(len(keys) + 1, 'end', curve[date_column].values[ends])
+    return segments
+
+
+def iter_curve_segments(curves, keys=MIXED_KEYS):
+    """
+    :param curves: generator of daily curves, ex. iter_mixed_curves(df)
+    :param keys: columns identifying one curve
+    :return: generator of the segments of each curve partition
+    """
+    for curve in curves:
+        yield curve_segments(curve, keys)
+
+
+def expand_segments(segments, start=None, end=None, keys=MIXED_KEYS, date_column='dateIndex'):
+    """
+    :param segments: output of curve_segments
+    :param start: first day to expand, first day of the segments by default
+    :param end: last day to expand (included), last day of the segments by default
+    :param keys: columns identifying one curve
+    :param date_column: name of the day column of the output
+    :return: daily rows of the segments between start and end, columns of the builders output
+    """
+    first = segments.start.values.astype('datetime64[D]')
+    last = segments.end.values.astype('datetime64[D]')
+    if start is not None:
+        first = np.maximum(first, np.datetime64(pd.Timestamp(start).date(), 'D'))
+    if end is not None:
+        last = np.minimum(last, np.datetime64(pd.Timestamp(end).date(), 'D'))
+    lengths = np.maximum((last - first).astype(np.int64) + 1, 0)
+
+    rows = np.repeat(np.arange(len(segments)), lengths)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    daily = segments.drop(['start', 'end'], axis=1).take(rows).reset_index(drop=True)
+    daily.insert(0, date_column, (first[rows] + offsets).astype('datetime64[ns]'))
+    return daily
+
+
+def segment_index(segments, keys=MIXED_KEYS):
+    """
+    :param segments: output of curve_segments
+    :param keys: columns identifying one curve
+    :return: dict {tuple of the key values: (segment start days, segment end days, segments of the curve)}, input of price_at
+    """
+    index = {}
+    for key, table in segments.groupby(keys, sort=False, observed=True):
+        table = table.sort_values('start')
+        index[key if isinstance(key, tuple) else (key,)] = (table.start.values.astype('datetime64[D]'),
+                                                            table.end.values.astype('datetime64[D]'),
+                                                            table.reset_index(drop=True))
+    return index
+
+
+def price_at(index, commodity, market, exchange, date, contract=None, column='price'):
+    """
+    :param index: output of segment_index
+    :param commodity: commodity of the curve
+    :param market: market of the curve
+    :param exchange: exchange of the curve
+    :param date: day to look up
+    :param contract: contract tier of a single curve (index built with SINGLE_KEYS), None for the mixed curve
+    :param column: value to return
+    :return: value of the curve on the date, nan if the curve does not cover it
+    """
+    key = (commodity, market, exchange) if contract is None else (commodity, market, exchange, contract)
+    if key not in index:
+        return np.nan
+    starts, ends, table = index[key]
+    day = np.datetime64(pd.Timestamp(date).date(), 'D')
+    position = np.searchsorted(starts, day, side='right') - 1
+    if position < 0 or ends[position] < day:
+        return np.nan
+    return table[column].iat[position]
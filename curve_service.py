@@ -0,0 +1,292 @@
+
+import json
+import os
+import socketserver
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread, Event
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+from stage_timing import get_logger
+
+"""
+@summary:
+In-memory query service of the last published forward curves (output table of commodities_futures_curve.py).
+    1. refresh loads the curves of the last trade date of every (commodity, market, exchange, curve_type) partition.
+       Contracts of one trade date settle at different times, so the curves are the rows of the whole last trade day.
+       Later calls reload only the partitions whose version changed: last trade day, row count and price sum
+       of its rows, so that a newer trade date and a republish of the same trade date (ex. the incremental
+       rebuild of a corrected partition by runMainFunction) are both picked up
+    2. each curve is held as a daily price array from its first day, with its cumulative sums:
+            point(commodity, market, exchange, date)                one array read
+            curve_range(commodity, market, exchange, start, end)    array slice
+            strip_average(commodity, market, exchange, start, end)  difference of cumulative sums
+       curve_type='single_curve' curves are identified by their tenor too (contractType1: 'month', 'quarter' ...)
+    3. serve exposes the same queries as json over http, on a tcp address or a unix socket:
+            GET /point?commodity=gas&market=ttf&exchange=ice&date=2020-01-15
+            GET /range?...&start=2020-01-01&end=2020-03-31
+            GET /strip?...&start=2020-04-01&end=2020-06-30[&curve_type=single_curve&tenor=quarter]
+    Rows are read with fetch(sql), getValuesFromTable by default. For a local SQLite stand-in of the output table:
+        connection = curve_writer.sqlite_tables(path)
+        refresh(fetch=lambda sql: connection.execute(sql).fetchall(), table_name='commodity_price_forward_curve_table')
+"""
+
+#Seconds between two refreshes of a running service
+REFRESH_SECONDS = 300
+
+#{(commodity, market, exchange, curve_type, tenor): curve}, replaced as a whole by refresh so queries need no lock.
+#   tenor is None for the mixed curves
+curves = {}
+
+#{(commodity, market, exchange, curve_type): (last trade day, row count, price sum of its rows) of the loaded curves}
+loaded_versions = {}
+
+#Decimals of the price sums compared between two refreshes, the sums of the same rows may differ in the last bits
+CHECKSUM_DECIMALS = 6
+
+refresh_lock = Lock()
+
+PARTITION_COLUMNS = ['commodity', 'market', 'exchange', 'curve_type']
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def day_number(value):
+    """
+    :param value: date as 'YYYY-MM-DD...' string, date, datetime or Timestamp
+    :return: proleptic ordinal of the day
+    """
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10]).toordinal()
+    return value.toordinal()
+
+
+def default_table():
+    return tb.commodity_price_forward_curve_table(tb.SYNCED)
+
+
+def build_curve(days, prices, trade_date):
+    """
+    :param days: delivery days of the curve (datetime64)
+    :param prices: price of each day
+    :param trade_date: trade date of the curve
+    :return: curve dict {'first_day', 'prices', 'sums', 'counts', 'trade_date'}: daily prices from the first day (nan on the
+             days without price), cumulative sums and counts of the available prices for the strip averages
+    """
+    ordinals = pd.to_datetime(days).values.astype('datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+    first_day = int(ordinals.min())
+    daily = np.full(int(ordinals.max()) - first_day + 1, np.nan)
+    daily[ordinals - first_day] = prices
+    available = ~np.isnan(daily)
+    return {'first_day': first_day,
+            'prices': daily,
+            'sums': np.concatenate([[0.0], np.cumsum(np.where(available, daily, 0.0))]),
+            'counts': np.concatenate([[0], np.cumsum(available)]),
+            'trade_date': trade_date}
+
+
+def sql_string(value):
+    return "'%s'" % str(value).replace("'", "''")
+
+
+def same_version(loaded, version):
+    """
+    :param loaded: (trade day, row count, price sum) of the loaded curves of a partition, None if not loaded
+    :param version: (trade day, row count, price sum) of the rows of the last trade day of the partition in the output table
+    :return: True if the loaded curves are the published ones
+    """
+    if loaded is None:
+        return False
+    return loaded[0] == version[0] and loaded[1] == version[1] and \
+        (loaded[2] == version[2] or (np.isnan(loaded[2]) and np.isnan(version[2])))
+
+
+def refresh(fetch=None, table_name=None):
+    """
+    :param fetch: fetch(sql) returning the rows of a query, getValuesFromTable by default
+    :param table_name: forward curve output table
+    :return: list of the partitions (commodity, market, exchange, curve_type) loaded by this refresh
+    """
+    global curves
+    fetch = fetch or getValuesFromTable
+    table_name = table_name or default_table()
+    # contracts of one trade date settle at different times: the last trade date is the whole day of MAX(utcTradeDate)
+    sql_latest = ''' SELECT t.commodity, t.market, t.exchange, t.curve_type, DATE(t.utcTradeDate), COUNT(*), SUM(t.price)
+                     FROM {table} t
+                     JOIN (SELECT commodity, market, exchange, curve_type, DATE(MAX(utcTradeDate)) AS tradeDate
+                           FROM {table}
+                           GROUP BY commodity, market, exchange, curve_type) latest
+                     ON t.commodity = latest.commodity AND t.market = latest.market AND t.exchange = latest.exchange
+                     AND t.curve_type = latest.curve_type AND t.utcTradeDate >= latest.tradeDate
+                     GROUP BY t.commodity, t.market, t.exchange, t.curve_type, DATE(t.utcTradeDate) '''
+    sql_curves = ''' SELECT commodity, market, exchange, curve_type, contractType1, utcTimeStamp, price, utcTradeDate
+                     FROM {table}
+                     WHERE {partitions} '''
+    with refresh_lock:
+        latest = pd.DataFrame.from_records(list(fetch(sql_latest.format(table=table_name))),
+                                           columns=PARTITION_COLUMNS + ['utcTradeDate', 'rows', 'price_sum'])
+        latest['utcTradeDate'] = pd.to_datetime(latest.utcTradeDate).dt.normalize()
+        latest['price_sum'] = pd.to_numeric(latest.price_sum, errors='coerce').astype(float).round(CHECKSUM_DECIMALS)
+        versions = {tuple(row[:4]): (row[4], int(row[5]), row[6]) for row in latest.values}
+        changed = [(c, m, e, t, version[0]) for (c, m, e, t), version in versions.items()
+                   if not same_version(loaded_versions.get((c, m, e, t)), version)]
+        if not changed:
+            return []
+
+        partitions = '\n                     OR '.join(
+            '(commodity = {} AND market = {} AND exchange = {} AND curve_type = {} '
+            'AND utcTradeDate >= {} AND utcTradeDate < {})'.format(
+                sql_string(c), sql_string(m), sql_string(e), sql_string(t), sql_string(d.strftime("%Y-%m-%d")),
+                sql_string((d + pd.Timedelta(days=1)).strftime("%Y-%m-%d")))
+            for c, m, e, t, d in changed)
+        rows = pd.DataFrame.from_records(list(fetch(sql_curves.format(table=table_name, partitions=partitions))),
+                                         columns=PARTITION_COLUMNS + ['tenor', 'utcTimeStamp', 'price', 'utcTradeDate'])
+        rows['utcTimeStamp'] = pd.to_datetime(rows.utcTimeStamp)
+        rows['price'] = pd.to_numeric(rows.price, errors='coerce').astype(float)
+        rows['utcTradeDate'] = pd.to_datetime(rows.utcTradeDate)
+        rows = rows.sort_values('utcTradeDate', kind='stable')   # the last settlement of a day wins
+        rows.loc[rows.curve_type != 'single_curve', 'tenor'] = ''
+
+        reloaded = set(changed_partition[:4] for changed_partition in changed)
+        updated = {key: curve for key, curve in curves.items() if key[:4] not in reloaded}
+        for key, table in rows.groupby(PARTITION_COLUMNS + ['tenor'], sort=False, dropna=False):
+            table = table.drop_duplicates('utcTimeStamp', keep='last')
+            key = key[:4] + ((key[4] if key[3] == 'single_curve' else None),)
+            updated[key] = build_curve(table.utcTimeStamp.values, table.price.values, table.utcTradeDate.max())
+        curves = updated
+        for c, m, e, t, d in changed:
+            loaded_versions[(c, m, e, t)] = versions[(c, m, e, t)]
+        return sorted(reloaded)
+
+
+def get_curve(commodity, market, exchange, curve_type='mixed_curve', tenor=None):
+    """
+    :return: curve dict of build_curve, None if it is not loaded
+    """
+    return curves.get((commodity, market, exchange, curve_type, tenor if curve_type == 'single_curve' else None))
+
+
+def point(commodity, market, exchange, day, curve_type='mixed_curve', tenor=None):
+    """
+    :param commodity: commodity of the curve, lowercase as in the output table
+    :param market: market of the curve
+    :param exchange: exchange of the curve
+    :param day: delivery day
+    :param curve_type: 'mixed_curve' or 'single_curve'
+    :param tenor: contractType1 of the single curve, ex. 'month'
+    :return: price of the curve on the day, nan if not covered
+    """
+    curve = get_curve(commodity, market, exchange, curve_type, tenor)
+    if curve is None:
+        return np.nan
+    position = day_number(day) - curve['first_day']
+    if position < 0 or position >= len(curve['prices']):
+        return np.nan
+    return curve['prices'][position]
+
+
+def curve_range(commodity, market, exchange, start, end, curve_type='mixed_curve', tenor=None):
+    """
+    :param start: first delivery day
+    :param end: last delivery day (included)
+    :return: float array of the prices of the days from start to end, nan on the days not covered
+    """
+    first, last = day_number(start), day_number(end)
+    result = np.full(max(last - first + 1, 0), np.nan)
+    curve = get_curve(commodity, market, exchange, curve_type, tenor)
+    if curve is None or len(result) == 0:
+        return result
+    lower = max(first, curve['first_day'])
+    upper = min(last, curve['first_day'] + len(curve['prices']) - 1)
+    if lower <= upper:
+        result[lower - first:upper - first + 1] = curve['prices'][lower - curve['first_day']:upper - curve['first_day'] + 1]
+    return result
+
+
+def strip_average(commodity, market, exchange, start, end, curve_type='mixed_curve', tenor=None):
+    """
+    :param start: first delivery day of the strip
+    :param end: last delivery day of the strip (included)
+    :return: average price over the days of the strip covered by the curve, nan if none is
+    """
+    curve = get_curve(commodity, market, exchange, curve_type, tenor)
+    if curve is None:
+        return np.nan
+    lower = max(day_number(start) - curve['first_day'], 0)
+    upper = min(day_number(end) - curve['first_day'] + 1, len(curve['prices']))
+    if lower >= upper:
+        return np.nan
+    count = curve['counts'][upper] - curve['counts'][lower]
+    return (curve['sums'][upper] - curve['sums'][lower]) / count if count else np.nan
+
+
+class CurveRequestHandler(BaseHTTPRequestHandler):
+    """
+    Json answers of the /point, /range and /strip queries, see the module summary
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            key = (query['commodity'], query['market'], query['exchange'])
+            options = {'curve_type': query.get('curve_type', 'mixed_curve'), 'tenor': query.get('tenor')}
+            if url.path == '/point':
+                answer = {'price': point(*key, query['date'], **options)}
+            elif url.path == '/range':
+                prices = curve_range(*key, query['start'], query['end'], **options)
+                days = pd.date_range(query['start'][:10], periods=len(prices)).strftime("%Y-%m-%d")
+                answer = {'dates': list(days), 'prices': list(prices)}
+            elif url.path == '/strip':
+                answer = {'average': strip_average(*key, query['start'], query['end'], **options)}
+            else:
+                self.send_error(404)
+                return
+        except (KeyError, ValueError) as e:
+            self.send_error(400, str(e))
+            return
+        body = json.dumps(answer).replace('NaN', 'null').encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super(UnixHTTPServer, self).get_request()
+        return request, ('unix', 0)
+
+
+def serve(address, fetch=None, table_name=None, refresh_seconds=REFRESH_SECONDS):
+    """
+    :param address: (host, port) of the http endpoint, or path of a unix socket
+    :param fetch: see refresh
+    :param table_name: see refresh
+    :param refresh_seconds: seconds between two refreshes, run in a background thread (fetch is called from it)
+    :return: (server, stop event). server.serve_forever() answers the queries, stop.set() ends the refreshes
+    """
+    refresh(fetch, table_name)
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.remove(address)
+        server = UnixHTTPServer(address, CurveRequestHandler)
+    else:
+        server = ThreadingHTTPServer(address, CurveRequestHandler)
+    stop = Event()
+
+    def refresh_loop():
+        while not stop.wait(refresh_seconds):
+            try:
+                refresh(fetch, table_name)
+            except Exception:
+                get_logger().exception('curve_service refresh failed, serving the curves already loaded')
+    Thread(target=refresh_loop, daemon=True).start()
+    return server, stop
@@ -0,0 +1,166 @@
+
+import numpy as np
+import pandas as pd
+
+try:
+    import scipy.sparse as sparse
+    from scipy.sparse.linalg import spsolve
+except ImportError:
+    sparse = None
+
+"""
+@summary:
+Arbitrage-free shaping of the mixed curves (output of create_mixed_curve).
+    The mixed curve stitches contracts by precedence: the price steps where a quarter and its months overlap,
+    and the days between contracts are forward-filled. Shaping solves, for every hub (commodity, market, exchange),
+    the daily curve x closest to a smooth one whose average over each contract's delivery days is the contract price:
+
+        minimize    smoothness * sum (x[d-1] - 2 x[d] + x[d+1])^2  +  weight * sum_contracts (A_c x - price_c)^2
+
+    A_c averages the delivery days of contract c (month, quarter, season, year strips, days, weeks ...).
+    All hubs are solved in one sparse system, block diagonal by hub, in its augmented form
+        [ smoothness D'D + eps I    A'          ] [x]   [0    ]
+        [ A                         -I / weight ] [y] = [price]
+    which keeps the nonzeros to the second differences D and one per contract day instead of the dense
+    year x year blocks of A'A. With a large weight the contract averages are reproduced
+    (up to the contradictions between overlapping quotes, spread in the least squares sense).
+    Requires scipy.
+"""
+
+#Weight of the second differences of the daily curve
+SMOOTHNESS = 1.0
+
+#Weight of the contract averages, large so that consistent contracts are reproduced
+CONSTRAINT_WEIGHT = 1e6
+
+#Diagonal regularization of the daily block, the augmented system stays quasi-definite
+RIDGE = 1e-9
+
+
+def require_scipy():
+    if sparse is None:
+        raise ImportError('curve_shaping requires scipy')
+
+
+def hub_calendar(contracts, keys):
+    """
+    :param contracts: contracts constraining the curves, with deliveryStart and deliveryEnd
+    :param keys: columns identifying one curve
+    :return: (hub of each contract, dataframe of the hubs: keys, first and last day, offset of their first day in x)
+    """
+    starts = pd.to_datetime(contracts.deliveryStart).values.astype('datetime64[D]')
+    ends = pd.to_datetime(contracts.deliveryEnd).values.astype('datetime64[D]')
+    groups = pd.DataFrame({'first': starts, 'last': ends}).groupby([contracts[k].astype(str).values for k in keys], sort=True)
+    hub = groups.ngroup().values
+    hubs = pd.concat([groups['first'].min(), groups['last'].max()], axis=1)
+    hubs.index.names = keys
+    hubs = hubs.reset_index()
+    days = (hubs['last'].values.astype('datetime64[D]') - hubs['first'].values.astype('datetime64[D]')).astype(np.int64) + 1
+    hubs['days'] = days
+    hubs['offset'] = np.cumsum(days) - days
+    return hub, hubs
+
+
+def averaging_matrix(contracts, hub, hubs):
+    """
+    :param contracts: contracts constraining the curves
+    :param hub: hub of each contract, from hub_calendar
+    :param hubs: hubs dataframe, from hub_calendar
+    :return: sparse matrix (contracts x days of all hubs), row c averages the delivery days of contract c
+    """
+    starts = pd.to_datetime(contracts.deliveryStart).values.astype('datetime64[D]')
+    ends = pd.to_datetime(contracts.deliveryEnd).values.astype('datetime64[D]')
+    lengths = np.maximum((ends - starts).astype(np.int64) + 1, 0)
+    first_day = hubs['first'].values.astype('datetime64[D]')[hub]
+    first_column = hubs.offset.values[hub] + (starts - first_day).astype(np.int64)
+    rows = np.repeat(np.arange(len(contracts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    values = np.repeat(1.0 / np.maximum(lengths, 1), lengths)
+    return sparse.csr_matrix((values, (rows, np.repeat(first_column, lengths) + offsets)),
+                             shape=(len(contracts), int(hubs.days.sum())))
+
+
+def second_differences(hubs):
+    """
+    :param hubs: hubs dataframe, from hub_calendar
+    :return: sparse matrix of the second differences of the daily curves, within each hub only
+    """
+    size = int(hubs.days.sum())
+    day_hub = np.repeat(np.arange(len(hubs)), hubs.days.values)
+    centers = np.arange(1, size - 1)
+    centers = centers[day_hub[centers - 1] == day_hub[centers + 1]]
+    rows = np.repeat(np.arange(len(centers)), 3)
+    columns = (centers[:, None] + np.array([-1, 0, 1])).ravel()
+    values = np.tile([1.0, -2.0, 1.0], len(centers))
+    return sparse.csr_matrix((values, (rows, columns)), shape=(len(centers), size))
+
+
+def solve_daily_curves(contracts, keys, smoothness=SMOOTHNESS, weight=CONSTRAINT_WEIGHT):
+    """
+    :param contracts: contracts constraining the curves: keys, deliveryStart, deliveryEnd, price
+    :param keys: columns identifying one curve
+    :param smoothness: weight of the second differences
+    :param weight: weight of the contract averages
+    :return: (hubs dataframe of hub_calendar, daily prices of all hubs, hub after hub from their offset)
+    """
+    require_scipy()
+    hub, hubs = hub_calendar(contracts, keys)
+    averages = averaging_matrix(contracts, hub, hubs)
+    differences = second_differences(hubs)
+    size, count = averages.shape[1], averages.shape[0]
+    curvature = smoothness * (differences.T @ differences) + RIDGE * sparse.identity(size)
+    system = sparse.bmat([[curvature, averages.T],
+                          [averages, -sparse.identity(count) / weight]], format='csc')
+    right_side = np.concatenate([np.zeros(size), contracts.price.values.astype(float)])
+    return hubs, spsolve(system, right_side)[:size]
+
+
+def shape_curves(curve, contracts, keys=('commodity', 'market', 'exchange'), smoothness=SMOOTHNESS, weight=CONSTRAINT_WEIGHT):
+    """
+    :param curve: mixed curves, one row per (hub, dateIndex)
+    :param contracts: contracts whose average price the shaped curves reproduce, ex. the active contracts of the hubs
+    :param keys: columns identifying one curve
+    :param smoothness: weight of the second differences
+    :param weight: weight of the contract averages
+    :return: curve with the shaped daily price. Days of hubs or dates without contracts keep their price
+    """
+    keys = list(keys)
+    contracts = contracts[contracts.price.notnull()].reset_index(drop=True)
+    curve = curve.copy()
+    if contracts.empty or curve.empty:
+        return curve
+    hubs, daily = solve_daily_curves(contracts, keys, smoothness, weight)
+
+    hub_index = pd.MultiIndex.from_arrays([hubs[k].astype(str).values for k in keys])
+    position = hub_index.get_indexer(pd.MultiIndex.from_arrays([curve[k].astype(str).values for k in keys]))
+    day = pd.to_datetime(curve.dateIndex).values.astype('datetime64[D]')
+    offset = (day - hubs['first'].values.astype('datetime64[D]')[position]).astype(np.int64)
+    covered = (position >= 0) & (offset >= 0) & (offset < hubs.days.values[position])
+    shaped = curve.price.values.astype(float)
+    shaped[covered] = daily[hubs.offset.values[position[covered]] + offset[covered]]
+    curve['price'] = shaped.astype(curve.price.dtype)
+    return curve
+
+
+def strip_residuals(curve, contracts, keys=('commodity', 'market', 'exchange')):
+    """
+    :param curve: mixed curves, shaped or not
+    :param contracts: contracts to check
+    :param keys: columns identifying one curve
+    :return: contracts with 'curve_average', the average of the curve over their delivery days, and 'residual' to their price
+    """
+    keys = list(keys)
+    days = pd.to_datetime(curve.dateIndex).values.astype('datetime64[D]')
+    daily = pd.Series(curve.price.values.astype(float),
+                      index=pd.MultiIndex.from_arrays([curve[k].astype(str).values for k in keys] + [days]))
+    starts = pd.to_datetime(contracts.deliveryStart).values.astype('datetime64[D]')
+    ends = pd.to_datetime(contracts.deliveryEnd).values.astype('datetime64[D]')
+    lengths = np.maximum((ends - starts).astype(np.int64) + 1, 0)
+    rows = np.repeat(np.arange(len(contracts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    lookup = pd.MultiIndex.from_arrays([contracts[k].astype(str).values[rows] for k in keys] + [starts[rows] + offsets])
+    values = daily.reindex(lookup).values
+    contracts = contracts.copy()
+    contracts['curve_average'] = pd.Series(values).groupby(rows).mean().reindex(np.arange(len(contracts))).values
+    contracts['residual'] = contracts.curve_average - contracts.price.astype(float)
+    return contracts
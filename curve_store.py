@@ -0,0 +1,114 @@
+
+import os
+from urllib.parse import quote
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+"""
+@summary:
+Columnar snapshot store of the contracts retrieved by getsqldata and of the built forward curves.
+    1. a dataset per content: 'contracts' (getsqldata output), 'single_curve' and 'mixed_curve' (rows of the output table)
+    2. parquet files partitioned by trade date and commodity, one file per (market, exchange):
+            STORE_DIR/<dataset>/tradeDate=2019-10-23/commodity=gas/<market>__<exchange>.parquet
+       rewriting a (trade date, commodity, market, exchange) replaces its file only, so incremental rebuilds
+       and the curves of each replaced partition can be written one at a time
+    3. read back with pyarrow datasets over memory-mapped files, filtered on the partitions before loading:
+       offline rebuilds (contracts), comparisons between trade dates, re-publishing curves with insertValuetoSQL
+    Requires pyarrow.
+"""
+
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'curve_store')
+
+#Column holding the trade date of the rows of each dataset
+TRADE_DATE_COLUMNS = {'contracts': 'utcTimeStamp', 'single_curve': 'utcTradeDate', 'mixed_curve': 'utcTradeDate'}
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError('curve_store requires pyarrow')
+
+
+def partition_path(dataset, trade_date, commodity, store_dir=None):
+    """
+    :return: directory of the (trade date, commodity) partition of the dataset
+    """
+    return os.path.join(store_dir or STORE_DIR, dataset, 'tradeDate=%s' % pd.Timestamp(trade_date).strftime("%Y-%m-%d"),
+                        'commodity=%s' % quote(str(commodity), safe=''))
+
+
+def write_snapshot(df, dataset, store_dir=None):
+    """
+    :param df: contracts or curve rows of one or several trade dates
+    :param dataset: 'contracts', 'single_curve' or 'mixed_curve'
+    :param store_dir: root directory of the store, STORE_DIR by default
+    :return: number of files written, one per (trade date, commodity, market, exchange) of df
+    """
+    require_pyarrow()
+    trade_dates = pd.to_datetime(df[TRADE_DATE_COLUMNS[dataset]]).dt.strftime("%Y-%m-%d")
+    keys = [trade_dates, df.commodity.astype(str), df.market.astype(str), df.exchange.astype(str)]
+    count = 0
+    for (trade_date, commodity, market, exchange), table in df.groupby(keys, sort=False):
+        path = partition_path(dataset, trade_date, commodity, store_dir)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        file_name = '%s__%s.parquet' % (quote(market, safe=''), quote(exchange, safe=''))
+        table = table.drop('commodity', axis=1).reset_index(drop=True)
+        for column in table.columns:
+            if pd.api.types.is_categorical_dtype(table[column]):
+                table[column] = table[column].astype(object)  # categories of the whole frame, not of the partition
+        pq.write_table(pa.Table.from_pandas(table, preserve_index=False), os.path.join(path, file_name))
+        count += 1
+    return count
+
+
+def open_dataset(dataset, store_dir=None):
+    """
+    :param dataset: 'contracts', 'single_curve' or 'mixed_curve'
+    :param store_dir: root directory of the store, STORE_DIR by default
+    :return: pyarrow dataset of the parquet files, memory-mapped, tradeDate and commodity read from the directories
+    """
+    require_pyarrow()
+    partitioning = ds.partitioning(pa.schema([('tradeDate', pa.string()), ('commodity', pa.string())]), flavor='hive')
+    return ds.dataset(os.path.join(store_dir or STORE_DIR, dataset), format='parquet', partitioning=partitioning,
+                      filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+
+
+def trade_dates(dataset, store_dir=None):
+    """
+    :param dataset: 'contracts', 'single_curve' or 'mixed_curve'
+    :param store_dir: root directory of the store, STORE_DIR by default
+    :return: sorted list of the trade dates 'YYYY-MM-DD' stored in the dataset
+    """
+    path = os.path.join(store_dir or STORE_DIR, dataset)
+    if not os.path.exists(path):
+        return []
+    return sorted(name.split('=', 1)[1] for name in os.listdir(path) if name.startswith('tradeDate='))
+
+
+def read_snapshot(dataset, trade_date=None, commodities=None, columns=None, store_dir=None):
+    """
+    :param dataset: 'contracts', 'single_curve' or 'mixed_curve'
+    :param trade_date: trade date to read, the last one stored by default
+    :param commodities: list of commodities to read, all by default
+    :param columns: columns to read, all by default
+    :param store_dir: root directory of the store, STORE_DIR by default
+    :return: dataframe of the rows of the trade date, commodity as first column (without tradeDate).
+             Empty dataframe if nothing is stored
+    """
+    dates = trade_dates(dataset, store_dir)
+    if not dates:
+        return pd.DataFrame(columns=columns)
+    trade_date = pd.Timestamp(trade_date).strftime("%Y-%m-%d") if trade_date is not None else dates[-1]
+    condition = ds.field('tradeDate') == trade_date
+    if commodities is not None:
+        condition = condition & ds.field('commodity').isin([str(c) for c in commodities])
+    table = open_dataset(dataset, store_dir).to_table(filter=condition).to_pandas()
+    ordered = ['commodity'] + [c for c in table.columns if c not in ('commodity', 'tradeDate')]
+    return table[columns if columns is not None else ordered].reset_index(drop=True)
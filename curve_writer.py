@@ -0,0 +1,230 @@
+
+import csv
+import os
+import sqlite3
+import tempfile
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+
+"""
+@summary:
+Chunked bulk writer for the forward curve outputs.
+    1. rows are converted column by column to python values following a typed column mapping
+       (one mapping per output table), then grouped in batches of BATCH_SIZE rows
+    2. batches are streamed from a dataframe or a generator of dataframes (iter_single_curves, iter_mixed_curves)
+       to an insert function insert(table_name, columns, rows):
+            insertValuesIntoTable of the framework,
+            dbapi_insert:   cursor.executemany, one statement per batch
+            load_data_insert: MySQL LOAD DATA LOCAL INFILE of a batch csv (COPY-style)
+       dbapi_replace deletes rows and inserts their replacement in one transaction of a DB-API connection
+    3. sqlite_tables builds a SQLite stand-in of the output tables for local runs
+"""
+
+BATCH_SIZE = 10000
+
+#Output table of commodities_futures_curve.py: tb.commodity_price_forward_curve_table
+FORWARD_CURVE_COLUMNS = OrderedDict([('utcTimeStamp', 'DATE'),
+                                     ('commodity', 'VARCHAR(64)'),
+                                     ('market', 'VARCHAR(64)'),
+                                     ('exchange', 'VARCHAR(64)'),
+                                     ('currency', 'VARCHAR(16)'),
+                                     ('unit', 'VARCHAR(16)'),
+                                     ('contractType1', 'VARCHAR(32)'),
+                                     ('contractType2', 'VARCHAR(64)'),
+                                     ('utcTradeDate', 'DATETIME'),
+                                     ('price', 'DOUBLE'),
+                                     ('open', 'DOUBLE'),
+                                     ('high', 'DOUBLE'),
+                                     ('low', 'DOUBLE'),
+                                     ('oi', 'BIGINT'),
+                                     ('volume', 'BIGINT'),
+                                     ('curve_type', 'VARCHAR(16)')])
+
+#Output table of full_year_price_curve.py: tb.commodities_prices_table
+COMMODITIES_PRICE_COLUMNS = OrderedDict([('commodity', 'VARCHAR(64)'),
+                                         ('market', 'VARCHAR(64)'),
+                                         ('contractName', 'VARCHAR(64)'),
+                                         ('utcTimeStamp', 'DATE'),
+                                         ('price', 'DOUBLE'),
+                                         ('metric_change', 'DOUBLE'),
+                                         ('price_usd_per_mwh', 'DOUBLE'),
+                                         ('exchange_rate', 'DOUBLE'),
+                                         ('price_euro_per_mwh', 'DOUBLE'),
+                                         ('currency_change', 'VARCHAR(16)'),
+                                         ('metrics_name', 'VARCHAR(32)'),
+                                         ('modelrunDate', 'DATE')])
+
+SQLITE_TABLES = {'commodity_price_forward_curve_table': FORWARD_CURVE_COLUMNS,
+                 'commodities_prices_table': COMMODITIES_PRICE_COLUMNS}
+
+
+def convert_column(values, sql_type):
+    """
+    :param values: pandas series
+    :param sql_type: sql type of the column in the output table, ex. 'DOUBLE', 'DATE', 'VARCHAR(64)'
+    :return: numpy object array of python values (float, int, str or None) ready for the db driver
+    """
+    sql_type = sql_type.split('(')[0].upper()
+    if sql_type in ('DOUBLE', 'FLOAT', 'DECIMAL') and values.dtype == np.float32:
+        # shortest decimal representation of the float32, 55.23 instead of 55.22999954223633, once per distinct value
+        codes, unique = pd.factorize(values.values)
+        converted = np.append(unique.astype(str).astype(float), np.nan)[codes].astype(object)
+    elif sql_type in ('DOUBLE', 'FLOAT', 'DECIMAL'):
+        converted = pd.to_numeric(values, errors='coerce').astype(float).values.astype(object)
+    elif sql_type in ('BIGINT', 'INT', 'INTEGER'):
+        converted = pd.to_numeric(values, errors='coerce').round().astype('Int64').values.astype(object)
+    elif sql_type in ('DATE', 'DATETIME'):
+        values = pd.to_datetime(values, errors='coerce')
+        converted = values.dt.strftime("%Y-%m-%d" if sql_type == 'DATE' else "%Y-%m-%d %H:%M:%S").values.astype(object)
+    else:
+        converted = values.values.astype(object)
+    converted[pd.isnull(converted)] = None
+    return converted
+
+
+def iter_batches(tables, column_types, batch_size=BATCH_SIZE):
+    """
+    :param tables: dataframe, or iterable of dataframes with the same columns
+    :param column_types: typed column mapping, ex. FORWARD_CURVE_COLUMNS. Columns missing in the mapping are sent as-is
+    :param batch_size: number of rows per batch
+    :return: generator of (columns, rows) with len(rows) <= batch_size, rows being a list of tuples.
+             A batch can hold rows of several consecutive dataframes
+    """
+    if isinstance(tables, pd.DataFrame):
+        tables = [tables]
+    columns, rows = None, []
+    for df in tables:
+        if columns is not None and list(df.columns) != columns:
+            if rows:
+                yield columns, rows
+            rows = []
+        columns = list(df.columns)
+        for start in range(0, len(df), batch_size):
+            chunk = df.iloc[start:start + batch_size]
+            converted = [convert_column(chunk[c], column_types.get(c, 'VARCHAR')) for c in columns]
+            rows.extend(zip(*converted))
+            while len(rows) >= batch_size:
+                yield columns, rows[:batch_size]
+                rows = rows[batch_size:]
+    if rows:
+        yield columns, rows
+
+
+def insert_frames(tables, table_name, column_types, insert, batch_size=BATCH_SIZE):
+    """
+    :param tables: dataframe, or iterable of dataframes (ex. iter_single_curves output) to insert
+    :param table_name: output table name
+    :param column_types: typed column mapping of the output table
+    :param insert: insert(table_name, columns, rows) function, ex. insertValuesIntoTable or dbapi_insert(connection)
+    :param batch_size: number of rows per insert call
+    :return: number of rows inserted
+    """
+    count = 0
+    for columns, rows in iter_batches(tables, column_types, batch_size):
+        insert(table_name, columns, rows)
+        count += len(rows)
+    return count
+
+
+def dbapi_insert(connection, paramstyle='%s'):
+    """
+    :param connection: DB-API connection (pymysql, MySQLdb, sqlite3 ...)
+    :param paramstyle: placeholder of the driver, '%s' for the MySQL drivers, '?' for sqlite3
+    :return: insert(table_name, columns, rows) function running one executemany per batch.
+             MySQL drivers rewrite it into a single multi-row INSERT
+    """
+    def insert(table_name, columns, rows):
+        cursor = connection.cursor()
+        cursor.executemany(insert_statement(table_name, columns, paramstyle), rows)
+        connection.commit()
+        cursor.close()
+    return insert
+
+
+def insert_statement(table_name, columns, paramstyle='%s'):
+    """
+    :return: parametrized INSERT statement of one row of the columns
+    """
+    return 'INSERT INTO {table} ({columns}) VALUES ({values})'.format(
+        table=table_name, columns=', '.join('`%s`' % c for c in columns), values=', '.join([paramstyle] * len(columns)))
+
+
+def dbapi_replace(connection, paramstyle='%s'):
+    """
+    :param connection: DB-API connection (pymysql, MySQLdb, sqlite3 ...), without autocommit
+    :param paramstyle: see dbapi_insert
+    :return: replace(table_name, delete_sql, tables, column_types, batch_size) function running the DELETE statement
+             and the inserts of the tables in one transaction: committed together, rolled back (and the error raised)
+             if any of them fails. It returns the number of rows inserted
+    """
+    def replace(table_name, delete_sql, tables, column_types, batch_size=BATCH_SIZE):
+        count = 0
+        cursor = connection.cursor()
+        try:
+            cursor.execute(delete_sql)
+            for columns, rows in iter_batches(tables, column_types, batch_size):
+                cursor.executemany(insert_statement(table_name, columns, paramstyle), rows)
+                count += len(rows)
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        return count
+    return replace
+
+
+def load_data_insert(connection):
+    """
+    :param connection: MySQL DB-API connection opened with local_infile enabled
+    :return: insert(table_name, columns, rows) function writing each batch to a temporary csv
+             and loading it with LOAD DATA LOCAL INFILE
+    """
+    def insert(table_name, columns, rows):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        try:
+            with os.fdopen(handle, 'w', newline='') as f:
+                writer = csv.writer(f, lineterminator='\n')
+                writer.writerows([['\\N' if v is None else v for v in row] for row in rows])
+            sql = """LOAD DATA LOCAL INFILE '{path}' INTO TABLE {table}
+                     FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' LINES TERMINATED BY '\\n'
+                     ({columns})""".format(path=path.replace('\\', '/'), table=table_name,
+                                           columns=', '.join('`%s`' % c for c in columns))
+            cursor = connection.cursor()
+            cursor.execute(sql)
+            connection.commit()
+            cursor.close()
+        finally:
+            os.remove(path)
+    return insert
+
+
+def sqlite_tables(path=':memory:'):
+    """
+    :param path: sqlite database file, in memory by default
+    :return: sqlite3 connection with the output tables of SQLITE_TABLES created, stand-in of the production database
+    """
+    connection = sqlite3.connect(path)
+    for table_name, column_types in SQLITE_TABLES.items():
+        columns = ', '.join('`%s` %s' % (c, t) for c, t in column_types.items())
+        connection.execute('CREATE TABLE IF NOT EXISTS {table} ({columns})'.format(table=table_name, columns=columns))
+    connection.commit()
+    return connection
+
+
+def sqlite_insert(connection):
+    """
+    :param connection: connection returned by sqlite_tables
+    :return: insert(table_name, columns, rows) function for the SQLite stand-in
+    """
+    return dbapi_insert(connection, paramstyle='?')
+
+
+def sqlite_replace(connection):
+    """
+    :param connection: connection returned by sqlite_tables
+    :return: replace(table_name, delete_sql, tables, column_types, batch_size) function for the SQLite stand-in
+    """
+    return dbapi_replace(connection, paramstyle='?')
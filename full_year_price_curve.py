@@ -1,11 +1,15 @@
 
-from threading import current_thread
+from threading import current_thread, BoundedSemaphore, Lock
+from collections import OrderedDict, namedtuple
+import functools
 import pandas as pd
 import numpy as np
 import warnings
-from datetime import datetime
-import re
-from calendar import monthrange
+from stage_timing import timed_stage
+import fx_cache
+import curve_store
+import curve_calendar
+from curve_writer import insert_frames, COMMODITIES_PRICE_COLUMNS, BATCH_SIZE
 warnings.filterwarnings("ignore")
 
 """
@@ -23,387 +27,404 @@ warnings.filterwarnings("ignore")
  
 """
 
-#Year in which to consider the full price curve. Setting it as a global variable
-years = '19'
-yearstamp = '2019'
+#Year in which to consider the full price curve, passed explicitly through the pipeline so several years can be built at once.
+#   year: 2019, yearstamp: '2019', years: '19' (suffix of the contract names), start_date / end_date: first and last day of the year
+CurveYearContext = namedtuple('CurveYearContext', ['year', 'yearstamp', 'years', 'start_date', 'end_date'])
 
+#Year built by runMainFunction
+CURVE_YEAR = 2019
 
+#Source of the forward data: 'database' (forward curve table) or 'store' (last mixed curves stored in curve_store)
+FORWARD_DATA_SOURCE = 'database'
 
-def get_historical_data(sql):
+#Exchange rates served by fx_cache, shared by the jobs and the runs. False queries them on every call of getexchange
+FX_CACHE = True
+
+
+def curve_year_context(year):
     """
-    :param sql:  SQL query for retrieving data
+    :param year: year of the full price curve, ex. 2019 or '2019'
+    :return: CurveYearContext of the year
+    """
+    year = int(year)
+    return CurveYearContext(year, str(year), str(year)[-2:], pd.Timestamp(year, 1, 1), pd.Timestamp(year, 12, 31))
+
+
+#Historical series of each commodity: the contract retained on each trade date.
+#   roll_offset: front contract is the month roll_offset months after the trade month (brent trades january in november),
+#                None for a single contract_name traded all year
+#   monthly_average: one average price per contract instead of the daily prices
+#   exchange: trading calendar (curve_calendar) of the contract expiries and of the business_day fill
+HISTORICAL_ROLLS = {'brent': {'commodity': 'Brent', 'market': 'IPE e-Brent', 'roll_offset': 2, 'monthly_average': True, 'exchange': 'ice'},
+                    'coal': {'commodity': 'coal', 'market': 'api2', 'roll_offset': 0, 'exchange': 'ice'},
+                    'gas': {'commodity': 'gas', 'market': 'ttf', 'contract_name': 'day-ahead', 'exchange': 'ice'},
+                    'carbon': {'commodity': 'Carbon', 'market': 'EUA', 'contract_name': 'Daily TP3', 'exchange': 'ice'}}
+
+#Fill policy of the blank days of the daily historical series (append_rows): 'ffill' holds the last price,
+#   'business_day' holds the price of the last trading day of the exchange, see append_rows
+HISTORICAL_FILL = 'ffill'
+
+
+def get_historical_data(name, context):
+    """
+    :param name: commodity of HISTORICAL_ROLLS, ex. 'brent'
+    :param context: CurveYearContext of the price curve
     :return:    data as dataframe
     """
-    global years
-    global yearstamp  #set year and yearstam as global value for sql query
-    sql = sql.format(years=years, yearstamp=yearstamp)
-    results = getValuesFromTable(sql.format(commodities_prices_table=commodities_prices_table(tb.SYNCED)))
+    return get_front_month_data(year=context.year, **HISTORICAL_ROLLS[name])
+
+
+def get_front_month_data(commodity, market, year, roll_offset=None, contract_name=None, monthly_average=False, exchange=None):
+    """
+    :param commodity: commodity name in the prices table, ex. 'coal'
+    :param market: market name in the prices table, ex. 'api2'
+    :param year: delivery year of the front contracts
+    :param roll_offset: the front contract of a trade date delivers roll_offset months after the trade month,
+                        the twelve contracts of year ('january19' ... 'december19') are retrieved from the trade month of january.
+                        None to retrieve contract_name over the year
+    :param contract_name: contract traded all year, ex. 'day-ahead', when roll_offset is None
+    :param monthly_average: average the price of each contract over its trade dates (rounded to 2 decimals)
+    :param exchange: exchange of the trading calendar, the contract of month M expires on the last trading day of
+                     month M - roll_offset. None for Monday to Friday
+    :return: dataframe ['commodity', 'market', 'contractName', 'utcTimeStamp', 'price'] of the front contract of each trade date
+    """
+    # one range on utcTimeStamp itself (no YEAR()/MONTH()) so the index on utcTimeStamp is used
+    sql = '''SELECT commodity, market, contractName, utcTimeStamp, price
+                FROM {tb_name}
+                WHERE commodity = '{commodity}'
+                AND market = '{market}'
+                AND utcTimeStamp >= '{start_date}' AND utcTimeStamp < '{end_date}'
+                AND contractName IN ({contract_names}) '''
+    first_month = pd.Timestamp(year=year, month=1, day=1) - pd.DateOffset(months=roll_offset or 0)
+    if roll_offset is None:
+        contract_names = [contract_name]
+    else:
+        months = pd.date_range(pd.Timestamp(year=year, month=1, day=1), periods=12, freq='MS')
+        contract_names = [m.strftime('%B').lower() + str(year)[-2:] for m in months]
+    results = getValuesFromTable(sql.format(tb_name=tb.commodities_prices_table(tb.SYNCED), commodity=commodity, market=market,
+                                            start_date=first_month.strftime("%Y-%m-%d"),
+                                            end_date=(first_month + pd.DateOffset(years=1)).strftime("%Y-%m-%d"),
+                                            contract_names=', '.join("'%s'" % c for c in contract_names)))
     columnNames = ['commodity', 'market', 'contractName', 'utcTimeStamp', "price"]
     df = pd.DataFrame.from_records(list(results), columns=columnNames)
-    return df
-
 
-def set_date_time(timestamp,):
+    # keep the contract which is front month on its trade date
+    if roll_offset is None:
+        front = (df.contractName.str.lower() == contract_name.lower()).values
+    else:
+        front_month = curve_calendar.front_months(df.utcTimeStamp, roll_offset, exchange)
+        front = df.contractName.str.lower().values == pd.DatetimeIndex(front_month).strftime('%B%y').str.lower()
+    df = df[front]
+    if monthly_average:
+        df = df.groupby('contractName', sort=False).agg({'commodity': 'first', 'market': 'first',
+                                                         'utcTimeStamp': 'max', 'price': 'mean'}).reset_index()
+        df['price'] = df.price.astype(float).round(2)
+        df = df[columnNames]
+    return df.reset_index(drop=True)
+
+
+def set_date_time(contract_names, context):
     """
-    :param timestamp: This is a short function specific for Brent data. Brent contract are retrieved for 2 months before, then the contractName(string)
-                        has to be used to get contract date period
-    :return: list of datetime values, gotten from string-like dates
+    :param contract_names: series of contract names, ex. 'march19'. This is a short function specific for Brent data.
+                           Brent contract are retrieved for 2 months before, then the contractName(string)
+                           has to be used to get contract date period
+    :param context: CurveYearContext of the price curve
+    :return: series of the last day of the delivery month of each contract in the year of context
     """
-    global yearstamp
-    date_ = re.split('(\d+)', timestamp)
-    whole_str = ' '.join((date_[0], yearstamp))
-    date_ = datetime.strptime(whole_str, '%B %Y')
-    date__ = str(date_.year) + '-' + str(date_.month) + '-' + str(monthrange(date_.year, date_.month)[1])
-    return  date__
+    months = contract_names.str.extract('^([a-zA-Z]+)', expand=False) + ' ' + context.yearstamp
+    return pd.to_datetime(months, format='%B %Y') + pd.offsets.MonthEnd(0)
 
-def build_date_index(df,end_value):
+def build_date_index(df, end_value, context):
     """
     :param df: Dataframe
     :param end_value: End Date for working dataframe. This end_value is last date from historical data available
+    :param context: CurveYearContext of the price curve, the working dataframe starts on its first day
     :return: Returns working dataframe with index as DataRange for a full curve
     """
-    global yearstamp
-    start_value, end_value = pd.to_datetime(yearstamp + '01' + '01', infer_datetime_format=True),pd.to_datetime((end_value), infer_datetime_format=True)
-    column_range = pd.date_range(start=start_value, end=end_value) #.strftime("%Y-%m-%d")
+    start_value, end_value = context.start_date, pd.to_datetime((end_value), infer_datetime_format=True)
+    column_range = curve_calendar.date_index(start_value, end_value)
     columnNames = df.columns
     newTable = pd.DataFrame(columns=columnNames, index=column_range)
     return newTable
 
 
-def append_rows(df, newTable):
+def append_rows(df, newTable, fill='ffill', exchange=None):
     """
     :param df:  Dataframe
     :param newTable:  Working dataframe with full DateRange index
-    :return: return a dataframe with rows appended from df into newTable, and then finally fill blank rows
+    :param fill: policy filling the blank rows of the calendar:
+                 'ffill'  last available values, values of the first date before it (default)
+                 'bfill'  next available values, values of the last date after it
+                 'linear' numeric columns interpolated in time, other columns as 'ffill'
+                 'business_day' blank numeric values hold the value of the last trading day of exchange before them,
+                                the values published on weekends and holidays are kept but not carried forward
+    :param exchange: exchange of the holidays of the 'business_day' fill, None for Monday to Friday
+    :return: return a dataframe with rows appended from df into newTable, and then finally fill blank rows.
+             Rows of df are aligned on the calendar by date, the last one wins for a date appearing twice
     """
-    for index, row in df.iterrows():
-        newTable.loc[index] =list(row)
-    newTable=newTable.fillna(method='ffill').fillna(method='bfill')
-    return newTable
-
-
-
-def get_forward_data(commodity, market, maxUtcTimeStamp):
+    rows = df.copy()
+    rows.index = pd.to_datetime(rows.index)
+    rows = rows[~rows.index.duplicated(keep='last')]
+    newTable = rows.reindex(newTable.index)[list(newTable.columns)]
+    numeric = newTable.select_dtypes(include=[np.number]).columns
+    if fill == 'bfill':
+        return newTable.fillna(method='bfill').fillna(method='ffill')
+    if fill == 'linear':
+        newTable[numeric] = newTable[numeric].interpolate(method='time')
+    elif fill == 'business_day':
+        trading_values = newTable[numeric].where(curve_calendar.is_trading_day(newTable.index, exchange)[:, None])
+        newTable[numeric] = newTable[numeric].fillna(trading_values.fillna(method='ffill'))
+    elif fill != 'ffill':
+        raise ValueError('Unknown fill policy %s' % fill)
+    return newTable.fillna(method='ffill').fillna(method='bfill')
+
+
+def get_forward_data(commodity, market, maxUtcTimeStamp, context):
     """
 
     :param commodity: commodity name to retrieve data ex. 'carbon'
     :param market: market name to retrieve data ex. 'eua'
     :param maxUtcTimeStamp: TimeStamp to retrieve data. This timestamp is the max date from historical data already downloaded
+    :param context: CurveYearContext of the price curve
     :return: FORWARD contracts data as dataframe
     """
-    global yearstamp
+    return get_forward_data_batch([(commodity, market, maxUtcTimeStamp)], context)[forward_key(commodity, market)]
+
+
+def forward_key(commodity, market):
+    """
+    :return: key of a (commodity, market) in the output of get_forward_data_batch. Forward curves are stored lowercased
+    """
+    return str(commodity).lower(), str(market).lower()
 
-    # retrieve data from last working week day
-    sql = '''SELECT commodity, market, contractType1 as 'contractName', utcTimeStamp, price 
+
+def get_forward_data_batch(requests, context):
+    """
+
+    :param requests: list of (commodity, market, maxUtcTimeStamp), see get_forward_data
+    :param context: CurveYearContext of the price curve
+    :return: dict {forward_key(commodity, market): FORWARD contracts data as dataframe}, retrieved in a single query.
+             One row per utcTimeStamp and (commodity, market), empty dataframe if no forward data
+    """
+    sql = '''SELECT commodity, market, contractType1 as 'contractName', utcTimeStamp, price
                         FROM {tb_name}
-                        WHERE commodity = '{commodity}'
-                        AND market= '{market}'
-                        AND curve_type = 'mixed_curve'                        
-                        AND DATE(utcTimeStamp) > DATE('{maxUtcTimeStamp}') 
-                        
-                        #the next line retrieves forward data until last day of YEARSTAMP, if all available contracts are required, comment this line
-                        AND DATE(utcTimeStamp) <   CONCAT({yearstamp},'-', '12', '-', '31')+ interval 1 DAY
-                          
-                        group by utcTimeStamp                       
+                        WHERE curve_type = 'mixed_curve'
+                        AND ({requests})
+
+                        #the next line retrieves forward data until last day of the year, if all available contracts are required, comment this line
+                        AND utcTimeStamp < '{end_date}' + interval 1 DAY
+
+                        ORDER BY commodity, market, utcTimeStamp
                        '''
-    results = getValuesFromTable(sql.format(commodity=commodity,  market=market, maxUtcTimeStamp=maxUtcTimeStamp, yearstamp=yearstamp, tb_name=commodities_prices_table(tb.SYNCED)))
+    request = "(commodity = '{commodity}' AND market = '{market}' AND utcTimeStamp >= DATE('{maxUtcTimeStamp}') + interval 1 DAY)"
+    requests = [(commodity, market, pd.Timestamp(maxUtcTimeStamp).strftime("%Y-%m-%d")) for commodity, market, maxUtcTimeStamp in requests]
+    if FORWARD_DATA_SOURCE == 'store':
+        return forward_data_from_store(requests, context)
+    results = getValuesFromTable(sql.format(requests='\n                        OR '.join(
+                                                request.format(commodity=c, market=m, maxUtcTimeStamp=d) for c, m, d in requests),
+                                            end_date=context.end_date.strftime("%Y-%m-%d"), tb_name=tb.commodities_prices_table(tb.SYNCED)))
     columnNames = ['commodity', 'market', 'contractName', 'utcTimeStamp', "price"]
     df = pd.DataFrame.from_records(list(results), columns=columnNames)
-    return df
+    df = df.drop_duplicates(['commodity', 'market', 'utcTimeStamp'])
+
+    keys = [df.commodity.astype(str).str.lower(), df.market.astype(str).str.lower()]
+    partitions = {key: table.reset_index(drop=True) for key, table in df.groupby(keys, sort=False)} if len(df) else {}
+    return {forward_key(c, m): partitions.get(forward_key(c, m), df.iloc[:0]) for c, m, _ in requests}
+
+
+def forward_data_from_store(requests, context):
+    """
+
+    :param requests: list of (commodity, market, maxUtcTimeStamp), see get_forward_data
+    :param context: CurveYearContext of the price curve
+    :return: same as get_forward_data_batch, read from the mixed curves of the last trade date of curve_store
+    """
+    columnNames = ['commodity', 'market', 'contractName', 'utcTimeStamp', "price"]
+    curves = curve_store.read_snapshot('mixed_curve', commodities=sorted(set(str(c).lower() for c, _, _ in requests)),
+                                       columns=['commodity', 'market', 'contractType1', 'utcTimeStamp', 'price'])
+    curves.columns = columnNames
+    curves['utcTimeStamp'] = pd.to_datetime(curves.utcTimeStamp)
+    forward_data = {}
+    for commodity, market, maxUtcTimeStamp in requests:
+        rows = curves[(curves.commodity.str.lower() == str(commodity).lower()).values &
+                      (curves.market.str.lower() == str(market).lower()).values &
+                      (curves.utcTimeStamp >= pd.Timestamp(maxUtcTimeStamp).normalize() + pd.Timedelta(days=1)).values &
+                      (curves.utcTimeStamp < context.end_date + pd.Timedelta(days=1)).values]
+        forward_data[forward_key(commodity, market)] = rows.sort_values('utcTimeStamp').drop_duplicates('utcTimeStamp').reset_index(drop=True)
+    return forward_data
+
+
+def historical_curve(name, context):
+    """
+
+    :param name: commodity of HISTORICAL_ROLLS with daily prices, ex. 'carbon'
+    :param context: CurveYearContext of the price curve
+    :return: historical data indexed by day from the first day of the year, blank days filled with append_rows
+    """
+    data = get_historical_data(name, context)
+    data.index = [date_.strftime(format="%Y-%m-%d") for date_ in pd.to_datetime(data['utcTimeStamp'])]
+
+    # Build empty table with full yearly date values as index
+    end_value = max(data.index)
+    new_table = build_date_index(data, end_value, context)
+
+    # Build up forward curve with data available and fillna
+    data = append_rows(data, new_table, HISTORICAL_FILL, HISTORICAL_ROLLS[name].get('exchange'))
+    data['utcTimeStamp'] = data.index
+    return data
+
+
+def forward_request(data):
+    """
+    :param data: output of historical_curve
+    :return: (commodity, market, maxUtcTimeStamp) to retrieve its forward data
+    """
+    return np.unique(data.commodity)[0], np.unique(data.market)[0], max(data.index).strftime("%Y-%m-%d")
+
+
+def append_forward_data(data, context, forward_data=None):
+    """
+    :param data: output of historical_curve
+    :param context: CurveYearContext of the price curve
+    :param forward_data: output of get_forward_data_batch including data's commodity, retrieved with get_forward_data if None
+    :return: historic and forward data concatenated
+    """
+    # Get forward data {Retrieve forward Data starting from max(date) of historical data}
+    commodity, market, maxUtcTimeStamp = forward_request(data)
+    if forward_data is None:
+        forward_data = get_forward_data_batch([(commodity, market, maxUtcTimeStamp)], context)
+    forward_data = forward_data[forward_key(commodity, market)].copy()
+    forward_data.index = forward_data.utcTimeStamp
+    # Merge historic and forward data
+    return pd.concat([data, forward_data]).drop_duplicates('utcTimeStamp')
+
 
 @DecorateErrorHandling
-def getexchange(exchange_rate_sql):
+@timed_stage()
+def getexchange(exchange_rate_sql, context, from_currency='USD', to_currency='EUR', publisher='ICIS', interval='daily'):
     """
-    :param exchange_rate_sql: SQL query to retrieve exchange rates for period in GLOBAL TIMESTAMP
-    :return: exchange rates for period in GLOBAL TIMESTAMP
+    :param exchange_rate_sql: SQL query to retrieve exchange rates of a currency pair between two dates
+    :param context: CurveYearContext of the price curve
+    :param from_currency: currency of the rates, ex. 'USD'
+    :param to_currency: ex. 'EUR'
+    :param publisher: publisher of the rates
+    :param interval: time interval of the rates
+    :return: exchange rates for the year of context, one row per day. Rates come from fx_cache if FX_CACHE is set
     """
-    global yearstamp
-    sql = exchange_rate_sql.format(yearstamp=yearstamp)
-    results = getValuesFromTable(sql.format(tblout_foreign_exchange_rate=tb.tblout_foreign_exchange_rate(tb.SYNCED),
-                                            tblout_exchange_rate_meta=tb.tblout_exchange_rate_meta(tb.SYNCED)))
-    columnNames = ["startlocTimeStamp", "fromCurrency", "toCurrency", "rate"]
-    df = pd.DataFrame.from_records(list(results), columns=columnNames)
+    def fetch(start_date, end_date):
+        sql = exchange_rate_sql.format(from_currency=from_currency, to_currency=to_currency, publisher=publisher, interval=interval,
+                                       start_date=pd.Timestamp(start_date).strftime("%Y-%m-%d"),
+                                       end_date=pd.Timestamp(end_date).strftime("%Y-%m-%d"))
+        results = getValuesFromTable(sql)
+        return pd.DataFrame.from_records(list(results), columns=fx_cache.RATE_COLUMNS)
+
+    if FX_CACHE:
+        df = fx_cache.get_rates(from_currency, to_currency, publisher, interval, context.start_date, context.end_date, fetch)
+    else:
+        df = fetch(context.start_date, context.end_date)
     df.index = df['startlocTimeStamp']
-    exchange_df = build_date_index(df,'2019-12-31')
+    exchange_df = build_date_index(df, context.end_date, context)
     full_exchange_df = append_rows(df, exchange_df)
     full_exchange_df['utcTimeStamp'] = full_exchange_df.index
     return full_exchange_df
 
 
-def rate_conversion(commodity_data, exchange_data, metric_change,metrics_name ):
+#Unit and currency conversion of the commodities to EUR per MWh, rate_conversion(data, full_exchange, **CONVERSIONS[name])
+CONVERSIONS = {'brent': {'metric_change': 1.6282, 'metrics_name': 'Barrel_to_MW/h', 'from_currency': 'USD', 'to_currency': 'EUR'},
+               'coal': {'metric_change': 8.141, 'metrics_name': 'tonne_to_MW/h', 'from_currency': 'USD', 'to_currency': 'EUR'}}
+
+
+def exchange_rates_asof(dates, exchange_data, from_currency='USD', to_currency='EUR'):
+    """
+    :param dates: dates to convert, any order
+    :param exchange_data: exchange rates with columns fromCurrency, toCurrency, rate and the date in utcTimeStamp (or the index),
+                          several currency pairs allowed
+    :param from_currency: currency of the prices
+    :param to_currency: currency to convert to
+    :return: float array of the rate of the pair on each date: last rate published on or before the date,
+             first rate of the data for dates before it, nan without any rate of the pair
+    """
+    pair = exchange_data[(exchange_data.fromCurrency == from_currency).values & (exchange_data.toCurrency == to_currency).values]
+    rate_dates = pair.utcTimeStamp if 'utcTimeStamp' in pair.columns else pair.index.to_series()
+    rates = pd.DataFrame({'date': pd.to_datetime(rate_dates).values,
+                          'rate': pd.to_numeric(pair['rate'], errors='coerce').astype(float).values})
+    rates = rates.dropna().sort_values('date')
+
+    dates = pd.to_datetime(pd.Series(dates)).values
+    result = np.full(len(dates), np.nan)
+    valid = np.flatnonzero(~pd.isnull(dates))
+    if len(rates) == 0 or len(valid) == 0:
+        return result
+    order = valid[np.argsort(dates[valid], kind='stable')]
+    matched = pd.merge_asof(pd.DataFrame({'date': dates[order]}), rates, on='date', direction='backward')
+    result[order] = matched['rate'].fillna(rates['rate'].iloc[0]).values
+    return result
+
+
+def rate_conversion(commodity_data, exchange_data, metric_change, metrics_name, from_currency='USD', to_currency='EUR'):
     """
     :param commodity_data:       Complete dataframe with historical and forward data concatenated together
     :param  exchange_data:      Complete (for whol year range) dataframe of exchange rate values.
     :param metric_change:       Metric value for conversion ex. 8.141 for barrel_to_MW/h ,
     :param metrics_name:        barrel_to_MW/h
-    :return:                    Dataframe which contains columns with relevant converted price
-    """
-    metric = metric_change
-    commodity_data['metric_change'] = metric
-    commodity_data['price_usd_per_mwh'] = commodity_data['price']/metric
-    commodity_data['exchange_rate'] = [np.float(rate) for rate in exchange_data['rate']]
-    commodity_data['price_euro_per_mwh'] = commodity_data['price_usd_per_mwh'] * commodity_data['exchange_rate']
-    commodity_data['currency_change'] = exchange_data['fromCurrency'] + '_' + exchange_data['toCurrency']
+    :param from_currency:       currency of the prices, ex. 'USD'
+    :param to_currency:         currency to convert to, ex. 'EUR'
+    :return:                    Dataframe which contains columns with relevant converted price.
+                                The rate of each row is the rate of its utcTimeStamp date (see exchange_rates_asof)
+    """
+    price = pd.to_numeric(commodity_data['price'], errors='coerce').astype(float).values
+    exchange_rate = exchange_rates_asof(commodity_data['utcTimeStamp'], exchange_data, from_currency, to_currency)
+    commodity_data['metric_change'] = metric_change
+    commodity_data['price_usd_per_mwh'] = price / metric_change
+    commodity_data['exchange_rate'] = exchange_rate
+    commodity_data['price_euro_per_mwh'] = commodity_data['price_usd_per_mwh'].values * exchange_rate
+    commodity_data['currency_change'] = from_currency + '_' + to_currency
     commodity_data['metrics_name'] = metrics_name
     commodity_data['modelrunDate'] = pd.datetime.now().date()
     return commodity_data
 
 
 @DecorateErrorHandling
-def insertValuetoSQL(df):
+@timed_stage()
+def insertValuetoSQL(df, insert=None, table_name=None, batch_size=BATCH_SIZE):
     """
     :param df: commodities contract prices forward curve
-    :return:
+    :param insert: insert(table_name, columns, rows) function, insertValuesIntoTable by default.
+                   curve_writer.sqlite_insert for the local SQLite stand-in
+    :param table_name: output table, tb.commodities_prices_table(UNSYNCED) by default
+    :param batch_size: number of rows sent per insert
+    :return: number of rows inserted
     """
-    df_list = df.values.tolist()
-    columns_name = df.columns
-    insertValuesIntoTable(tb.commodities_prices_table(UNSYNCED), columns_name, df_list)
-    return
-
-
-
-brent_sql = '''
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" 
-            from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'-1
-                AND MONTH(utctimestamp)= 11
-                AND a.contractName=concat("january",'{years}') 
-            union   
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" 
-            from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'-1
-                AND MONTH(utctimestamp)= 12
-                AND a.contractName=concat("february",'{years}') 
-
-            union   
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" 
-            from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)= 1
-                AND a.contractName=concat("march",'{years}') 
-
-                union   
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" 
-            from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)= 2
-                AND a.contractName=concat("April",'{years}')        
-
-                    union   
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" 
-            from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)= 3
-                AND a.contractName=concat("may",'{years}') 
-
-                    union   
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" 
-            from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)= 4
-                AND a.contractName=concat("june",'{years}')     
-
-                        union   
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" 
-            from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)= 5
-                AND a.contractName=concat("july",'{years}')     
-
-                            union   
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)= 6
-                AND a.contractName=concat("august",'{years}')   
-
-                                union   
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)= 7
-                AND a.contractName=concat("september",'{years}') 
-
-                                    union   
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)= 8
-                AND a.contractName=concat("october",'{years}') 
-
-                                        union   
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)= 9
-                AND a.contractName=concat("november",'{years}') 
-
-                                            union   
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,round(avg(price),2) AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="Brent" 
-                AND market='IPE e-Brent' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)= 10
-                AND a.contractName=concat("december",'{years}') '''
-
-gas_sql = """
-            SELECT commodity, market,contractName,utcTimeStamp,price   
-            FROM tblpr_commodities_prices
-            WHERE commodity="gas" 
-            AND contractname="day-ahead" 
-            AND YEAR(utctimestamp)='{yearstamp}'
-            AND market='ttf'  """
-
-
-coal_sql = """
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)=1
-                AND a.contractName=concat("January",'{years}') 
-                
-            UNION 
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)=2
-                AND a.contractName=concat("february",'{years}') 
-            UNION 
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)=3
-                AND a.contractName=concat("march",'{years}') 
-            UNION 
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)=4
-                AND a.contractName=concat("april",'{years}') 
-            UNION 
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)=5
-                AND a.contractName=concat("may",'{years}') 
-            UNION 
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)=6 
-                AND a.contractName=concat("june",'{years}') 
-            UNION 
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)=7
-                AND a.contractName=concat("july",'{years}') 
-            UNION 
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)=8
-                AND a.contractName=concat("august",'{years}') 
-            UNION 
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}' 
-                AND MONTH(utctimestamp)=9
-                AND a.contractName=concat("september",'{years}') 
-            UNION 
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)=10
-                AND a.contractName=concat("october",'{years}') 
-            UNION 
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}' 
-                AND MONTH(utctimestamp)=11
-                AND a.contractName=concat("november",'{years}') 
-            UNION 
-            SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price AS "price" from tblpr_commodities_prices a 
-                WHERE commodity="coal" 
-                AND market='api2' 
-                AND YEAR(utctimestamp)='{yearstamp}'
-                AND MONTH(utctimestamp)=12
-                AND a.contractName=concat("december",'{years}')  """
-
-
-
-carbon_sql = """ SELECT a.commodity, a.market,a.contractName,a.utcTimeStamp,price 
-                    from tblpr_commodities_prices a 
-                        WHERE commodity="Carbon" 
-                        AND market='EUA' 
-                        and YEAR(utctimestamp)='{yearstamp}'
-                    #   and MONTH(utctimestamp)=1
-                       and a.contractName='Daily TP3' 
-                    #   AND a.contractName=concat("January",'{years}') """
+    insert = insert or insertValuesIntoTable
+    table_name = table_name or tb.commodities_prices_table(UNSYNCED)
+    return insert_frames(df, table_name, COMMODITIES_PRICE_COLUMNS, insert, batch_size)
+
+
 
 exchange_rate_sql = """ select t1.startLocTimeStamp, t2.fromCurrency, t2.toCurrency , t1.rate
                     from tblout_foreign_exchange_rate_data t1
                     inner join tblout_foreign_exchange_rate_meta t2
                     using(sourceID)
-                    where t2.fromCurrency='USD'
-                    and t2.toCurrency='EUR'
-                    and t2.timeInterval='daily'
-                    and t2.publisher='ICIS'
-                    and year(t1.startLocTimeStamp)='{yearstamp}' """
+                    where t2.fromCurrency='{from_currency}'
+                    and t2.toCurrency='{to_currency}'
+                    and t2.timeInterval='{interval}'
+                    and t2.publisher='{publisher}'
+                    and t1.startLocTimeStamp >= '{start_date}' and t1.startLocTimeStamp < '{end_date}' + interval 1 day """
 
 
-def get_carbon():
+@timed_stage(input_rows=False)
+def get_carbon(context, full_exchange=None, carbon_data=None, forward_data=None):
     """ Go through sets of function to retrieve CARBON historical data and forward data and merge them both, then finally make the conversion with the exchange rates
+    :param context: CurveYearContext of the price curve
+    :param full_exchange: output of getexchange, unused while carbon is not converted
+    :param carbon_data: historical_curve('carbon'), retrieved if None
+    :param forward_data: output of get_forward_data_batch, retrieved if None
     :return:
     """
-    # historical carbon
-    carbon_data = get_historical_data(carbon_sql)
-    carbon_data.index = [date_.strftime(format="%Y-%m-%d") for date_ in
-                         pd.to_datetime(carbon_data['utcTimeStamp'])]
-
-    # Build empty table with full yearly date values as index
-    end_value = max(carbon_data.index)
-    new_table = build_date_index(carbon_data, end_value)
-
-    # Build up forward curve with data available and fillna
-    carbon_data = append_rows(carbon_data, new_table)
-    carbon_data['utcTimeStamp'] = carbon_data.index
-    commodity, market, maxUtcTimeStamp = np.unique(carbon_data.commodity)[0], np.unique(carbon_data.market)[0], max(carbon_data.index).strftime("%Y-%m-%d")
-
-    # Get forward data {Retrieve forward Data starting from max(date) of historical data}
-    forward_data = get_forward_data(commodity, market, maxUtcTimeStamp)
-    forward_data.index = forward_data.utcTimeStamp
-    # Merge historic and forward data
-    carbon_data = pd.concat([carbon_data, forward_data]).drop_duplicates('utcTimeStamp')
+    # historical carbon, merged with forward data
+    if carbon_data is None:
+        carbon_data = historical_curve('carbon', context)
+    carbon_data = append_forward_data(carbon_data, context, forward_data)
 
     # IF no rate conversion to be made, set appropriate columns for db table
     carbon_data = carbon_data.assign(**{'metric_change': 0,
@@ -420,106 +441,197 @@ def get_carbon():
     # carbon_data= rate_conversion(carbon_data, full_exchange, metric_change=1.6282, metrics_name='Barrel_to_MW/h')
     return carbon_data
 
-def get_brent(full_exchange):
-    #Go through sets of function to retrieve BRENT historical data and forward data and merge them both, then finally make the conversion with the exchange rates
-    # GET Brent data from table
-    brent_data = get_historical_data(brent_sql)
-    brent_data['utcTimeStamp'] = brent_data['contractName'].apply(set_date_time)
+
+def brent_curve(context):
+    """
+
+    :param context: CurveYearContext of the price curve
+    :return: brent front month monthly averages, indexed by day from the first day of the year, blank days filled with append_rows
+    """
+    brent_data = get_historical_data('brent', context)
+    brent_data['utcTimeStamp'] = set_date_time(brent_data['contractName'], context)
     brent_data.index = pd.to_datetime(brent_data['utcTimeStamp'], infer_datetime_format=True)
 
     # Build empty table with full yearly date values as index
     end_value = max(brent_data.index)
-    new_table = build_date_index(brent_data, end_value)
+    new_table = build_date_index(brent_data, end_value, context)
 
     # Build up forward curve with data available and fillna
     brent_data = append_rows(brent_data, new_table)
-    brent_data.utcTimeStamp =brent_data.index
+    brent_data.utcTimeStamp = brent_data.index
+    return brent_data
 
-    # No forward data for brent.. if required run the below code line
-    # Retrieve forward Data starting from max(date) of historical data
-    # forward_data = get_forward_data(commodity, market, maxUtcTimeStamp)
+
+@timed_stage(input_rows=False)
+def get_brent(context, full_exchange, brent_data=None, forward_data=None):
+    """ Go through sets of function to retrieve BRENT historical data and merge it with forward data if any, then finally make the conversion with the exchange rates
+    :param context: CurveYearContext of the price curve
+    :param full_exchange: output of getexchange
+    :param brent_data: brent_curve(context), retrieved if None
+    :param forward_data: output of get_forward_data_batch including brent. None, as PRICE_CURVE_JOBS runs it,
+                         keeps the historical data only: there is no brent forward curve
+    :return:
+    """
+    if brent_data is None:
+        brent_data = brent_curve(context)
+    if forward_data is not None:
+        brent_data = append_forward_data(brent_data, context, forward_data)
 
     # Finally convert to preferred currency and measure metric
-    brent_data = rate_conversion(brent_data, full_exchange, metric_change=1.6282, metrics_name='Barrel_to_MW/h')
-    brent_data['currency_change'] = 'USD_EUR'
+    brent_data = rate_conversion(brent_data, full_exchange, **CONVERSIONS['brent'])
 
     return brent_data
 
-def get_gas():
-        #Go through sets of function to retrieve GAS historical data and forward data and merge them both, then finally make the conversion with the exchange rates
-        #gas
-        gas_data = get_historical_data(gas_sql)
-        gas_data.index = [date_.strftime(format="%Y-%m-%d") for date_ in
-                          pd.to_datetime(gas_data['utcTimeStamp'])]  # , format="%Y-%m-%d",exact=False)]
-
-        # Build empty table with full yearly date values as index
-        end_value = max(gas_data.index)
-        new_table = build_date_index(gas_data, end_value)
-        # Build up forward curve with data available and fillna
-        gas_data = append_rows(gas_data, new_table)
-        gas_data['utcTimeStamp'] = gas_data.index
-
-        # Get forward data {Retrieve forward Data starting from max(date) of historical data}
-        commodity, market, maxUtcTimeStamp = np.unique(gas_data.commodity)[0], np.unique(gas_data.market)[0], max(
-            gas_data.index).strftime("%Y-%m-%d")
-        forward_data = get_forward_data(commodity, market, maxUtcTimeStamp)
-        forward_data.index = forward_data.utcTimeStamp
-
-        # Merge historic and forward data
-        gas_data = pd.concat([gas_data, forward_data]).drop_duplicates('utcTimeStamp')
-        gas_data['price_euro_per_mwh'] = gas_data.price
-        return gas_data
-
-def get_coal(full_exchange):
-    #Go through sets of function to retrieve COAL historical data and forward data and merge them both, then finally make the conversion with the exchange rates
-    # coal
-    coal_data = get_historical_data(coal_sql)
-    coal_data.index = [date_.strftime(format="%Y-%m-%d") for date_ in
-                       pd.to_datetime(coal_data['utcTimeStamp'])]  # , format="%Y-%m-%d",exact=False)]
+@timed_stage(input_rows=False)
+def get_gas(context, full_exchange=None, gas_data=None, forward_data=None):
+    """ Go through sets of function to retrieve GAS historical data and forward data and merge them both
+    :param context: CurveYearContext of the price curve
+    :param full_exchange: output of getexchange, unused as gas is not converted
+    :param gas_data: historical_curve('gas'), retrieved if None
+    :param forward_data: output of get_forward_data_batch, retrieved if None
+    :return:
+    """
+    if gas_data is None:
+        gas_data = historical_curve('gas', context)
+    gas_data = append_forward_data(gas_data, context, forward_data)
+    gas_data['price_euro_per_mwh'] = gas_data.price
+    return gas_data
+
+
+@timed_stage(input_rows=False)
+def get_coal(context, full_exchange, coal_data=None, forward_data=None):
+    """ Go through sets of function to retrieve COAL historical data and forward data and merge them both, then finally make the conversion with the exchange rates
+    :param context: CurveYearContext of the price curve
+    :param full_exchange: output of getexchange
+    :param coal_data: historical_curve('coal'), retrieved if None
+    :param forward_data: output of get_forward_data_batch, retrieved if None
+    :return:
+    """
+    if coal_data is None:
+        coal_data = historical_curve('coal', context)
+    coal_data = append_forward_data(coal_data, context, forward_data)
 
-    # Build empty table with full yearly date values as index
-    end_value = max(coal_data.index)
-    new_table = build_date_index(coal_data, end_value
-                                 )
-    # Build up forward curve with data available and fillna
-    coal_data = append_rows(coal_data, new_table)
-    coal_data['utcTimeStamp'] = coal_data.index
+    # Finally convert to preferred currency and measure metric
+    coal_data = rate_conversion(coal_data, full_exchange, **CONVERSIONS['coal'])
 
-    # Get forward data {Retrieve forward Data starting from max(date) of historical data}
-    commodity, market, maxUtcTimeStamp = np.unique(coal_data.commodity)[0], np.unique(coal_data.market)[0], max(
-        coal_data.index).strftime("%Y-%m-%d")
-    forward_data = get_forward_data(commodity, market, maxUtcTimeStamp)
-    forward_data.index = forward_data.utcTimeStamp
+    return coal_data
 
-    # Merge historic and forward data
-    coal_data = pd.concat([coal_data, forward_data]).drop_duplicates('utcTimeStamp')
 
-    # Finally convert to preferred currency and measure metric
-    coal_data = rate_conversion(coal_data, full_exchange, metric_change=8.141, metrics_name='tonne_to_MW/h')
+#Commodity jobs of the full year price curve, run in this order by runMainFunction.
+#   build: build(context, full_exchange, data, forward_data) returning the rows of the commodities prices table
+#   forward_data: data is historical_curve(name) and forward_data holds its forward curve, else both are None
+PRICE_CURVE_JOBS = OrderedDict([('carbon', {'build': get_carbon, 'forward_data': True}),
+                                ('brent', {'build': get_brent, 'forward_data': False}),
+                                ('gas', {'build': get_gas, 'forward_data': True}),
+                                ('coal', {'build': get_coal, 'forward_data': True})])
 
-    return coal_data
+#Number of commodity jobs running at the same time, each one mostly waits for the database
+PRICE_CURVE_WORKERS = 4
 
+#Number of years built at the same time by runMultiYear
+YEAR_WORKERS = 2
 
-@DecorateErrorHandling
-def runMainFunction():
+#Inserts of the years built at the same time go one at a time
+insert_lock = Lock()
+
+
+def run_jobs(jobs, max_workers=PRICE_CURVE_WORKERS):
+    """
+    :param jobs: OrderedDict {name: function()}
+    :param max_workers: maximum number of jobs running at the same time
+    :return: (OrderedDict {name: result} of the jobs which succeeded, OrderedDict {name: exception} of the failed ones).
+             Jobs run in CustomThreads sharing the run-time controller of the current thread,
+             a failed job does not stop the others
+    """
     runTimeController = current_thread().getRunTimeController()
     logger = runTimeController.logger.getLogger()
+    slots = BoundedSemaphore(max_workers)
+    results, errors = {}, {}
+
+    def run(name, function):
+        with slots:
+            try:
+                results[name] = function()
+            except Exception as e:
+                logger.exception('%s job failed' % name)
+                errors[name] = e
+
+    threads = [CustomThread(runTimeController=runTimeController, target=run, args=(name, function))
+               for name, function in jobs.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (OrderedDict((name, results[name]) for name in jobs if name in results),
+            OrderedDict((name, errors[name]) for name in jobs if name in errors))
+
+
+def build_curve_year(context, names=None, max_workers=PRICE_CURVE_WORKERS):
+    """
+    :param context: CurveYearContext of the price curve
+    :param names: commodities of PRICE_CURVE_JOBS to build, all by default
+    :param max_workers: number of commodity jobs running at the same time
+    :return: inserts the full year price curves of the commodities, raises RuntimeError naming the failed ones
+    """
+    runTimeController = current_thread().getRunTimeController()
+    logger = runTimeController.logger.getLogger()
+    jobs = OrderedDict((name, PRICE_CURVE_JOBS[name]) for name in (names or PRICE_CURVE_JOBS))
+
+    # Get exchange rates, and build complete dateIndex with full year range. Shared read-only by the jobs
+    full_exchange = getexchange(exchange_rate_sql, context)
 
-    # Get exchange rates, and build complete dateIndex with full year range
-    full_exchange = getexchange(exchange_rate_sql)
+    # Historical data of the jobs, then the forward data of all of them in one query
+    history, failed = run_jobs(OrderedDict((name, functools.partial(historical_curve, name, context))
+                                           for name, job in jobs.items() if job['forward_data']), max_workers)
+    forward_data = get_forward_data_batch([forward_request(data) for data in history.values()], context) if history else {}
 
-    #INSERT CARBON DATA TO TABLE
-    insertValuetoSQL(get_carbon())
+    tables, errors = run_jobs(OrderedDict((name, functools.partial(job['build'], context, full_exchange, history.get(name),
+                                                                   forward_data if name in history else None))
+                                          for name, job in jobs.items() if name not in failed), max_workers)
+    failed.update(errors)
 
-    # INSERT BRENT DATA TO TABLE
-    insertValuetoSQL(get_brent(full_exchange))
+    # INSERT DATA TO TABLE, one commodity at a time
+    for name, table in tables.items():
+        with insert_lock:
+            insertValuetoSQL(table)
+        logger.info('%s %s inserted' % (context.yearstamp, name))
 
-    # INSERT GAS DATA TO TABLE
-    insertValuetoSQL(get_gas())
+    if failed:
+        raise RuntimeError('Price curve jobs of %s failed: %s' % (context.yearstamp, ', '.join(failed)))
 
-    # INSERT COAL DATA TO TABLE
-    insertValuetoSQL(get_coal(full_exchange))
 
+@DecorateErrorHandling
+def runMainFunction(names=None, max_workers=PRICE_CURVE_WORKERS, year=CURVE_YEAR):
+    """
+    :param names: commodities of PRICE_CURVE_JOBS to build, all by default
+    :param max_workers: number of commodity jobs running at the same time
+    :param year: year of the full price curve
+    :return:
+    """
+    runTimeController = current_thread().getRunTimeController()
+    logger = runTimeController.logger.getLogger()
+    build_curve_year(curve_year_context(year), names, max_workers)
+    logger.info('Done')
+
+
+@DecorateErrorHandling
+def runMultiYear(first_year=CURVE_YEAR, last_year=None, names=None, max_workers=PRICE_CURVE_WORKERS, year_workers=YEAR_WORKERS):
+    """
+    :param first_year: first year of the full price curves to build
+    :param last_year: last year (included), the current year by default
+    :param names: commodities of PRICE_CURVE_JOBS to build, all by default
+    :param max_workers: number of commodity jobs running at the same time within a year
+    :param year_workers: number of years built at the same time
+    :return: builds the years concurrently, a failed year does not stop the others
+    """
+    runTimeController = current_thread().getRunTimeController()
+    logger = runTimeController.logger.getLogger()
+    last_year = last_year or pd.Timestamp.today().year
+    contexts = [curve_year_context(year) for year in range(int(first_year), int(last_year) + 1)]
+    _, failed = run_jobs(OrderedDict((context.yearstamp, functools.partial(build_curve_year, context, names, max_workers))
+                                     for context in contexts), year_workers)
+    if failed:
+        raise RuntimeError('Price curve years failed: %s' % ', '.join(failed))
     logger.info('Done')
 
 
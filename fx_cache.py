@@ -0,0 +1,167 @@
+
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+"""
+@summary:
+Cache of the exchange rates retrieved by full_year_price_curve.getexchange, shared by the curve jobs and years of a process
+and by the next runs through the disk.
+    1. a series is identified by (fromCurrency, toCurrency, publisher, timeInterval), its entry holds the rates
+       of the date range already retrieved [start_date, end_date]
+    2. tiers: in memory (LRU of FX_CACHE_SIZE series), then on disk in FX_CACHE_DIR (parquet, pickle without pyarrow),
+       then the database through the fetch function
+    3. a request inside the cached range is served from the cache while the entry is younger than FX_CACHE_TTL.
+       Otherwise only the dates after the last cached rate are fetched (incremental top-up),
+       the whole range when it starts before the cached one
+"""
+
+FX_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fx_cache')
+
+#Number of series kept in memory
+FX_CACHE_SIZE = 16
+
+#Age after which the rates of a series are topped up from the database
+FX_CACHE_TTL = pd.Timedelta(hours=6)
+
+RATE_COLUMNS = ["startlocTimeStamp", "fromCurrency", "toCurrency", "rate"]
+
+memory_cache = OrderedDict()
+
+#Lock of the memory tier, held for its reads and writes only
+cache_lock = Lock()
+
+#{series key: lock}, a series is loaded and fetched by one thread at a time while the other series are served
+series_locks = {}
+
+
+def series_file(key, cache_dir=FX_CACHE_DIR):
+    """
+    :param key: (fromCurrency, toCurrency, publisher, timeInterval)
+    :param cache_dir: directory of the disk tier
+    :return: path of the rates of the series, without extension
+    """
+    return os.path.join(cache_dir, '_'.join(str(k) for k in key).replace('/', '-'))
+
+
+def load_entry(key, cache_dir=FX_CACHE_DIR):
+    """
+    :param key: (fromCurrency, toCurrency, publisher, timeInterval)
+    :param cache_dir: directory of the disk tier
+    :return: entry {'rates', 'start_date', 'end_date', 'fetched_at'} stored on disk, None if there is none
+    """
+    path = series_file(key, cache_dir)
+    rates_path = path + ('.parquet' if pyarrow is not None else '.pkl')
+    if not os.path.exists(path + '.json') or not os.path.exists(rates_path):
+        return None
+    with open(path + '.json') as f:
+        entry = {k: pd.Timestamp(v) for k, v in json.load(f).items()}
+    entry['rates'] = pd.read_parquet(rates_path) if pyarrow is not None else pd.read_pickle(rates_path)
+    return entry
+
+
+def save_entry(key, entry, cache_dir=FX_CACHE_DIR):
+    """
+    :param key: (fromCurrency, toCurrency, publisher, timeInterval)
+    :param entry: entry {'rates', 'start_date', 'end_date', 'fetched_at'}
+    :param cache_dir: directory of the disk tier
+    :return:
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    path = series_file(key, cache_dir)
+    if pyarrow is not None:
+        entry['rates'].to_parquet(path + '.parquet', index=False)
+    else:
+        entry['rates'].to_pickle(path + '.pkl')
+    temp_path = path + '.json.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({k: str(v) for k, v in entry.items() if k != 'rates'}, f, indent=1)
+    os.replace(temp_path, path + '.json')
+
+
+def merge_rates(cached, fetched):
+    """
+    :param cached: rates of the entry, None if no entry
+    :param fetched: rates just retrieved
+    :return: rates of both ordered by date, the fetched rate wins for a date present in both
+    """
+    fetched = fetched[RATE_COLUMNS].copy()
+    fetched['startlocTimeStamp'] = pd.to_datetime(fetched.startlocTimeStamp)
+    fetched['rate'] = pd.to_numeric(fetched.rate, errors='coerce').astype(float)
+    rates = fetched if cached is None else pd.concat([cached, fetched])
+    rates = rates.drop_duplicates('startlocTimeStamp', keep='last').sort_values('startlocTimeStamp')
+    return rates.reset_index(drop=True)
+
+
+def series_lock(key):
+    """
+    :param key: (fromCurrency, toCurrency, publisher, timeInterval)
+    :return: lock of the series, serializing its disk tier and database reads
+    """
+    with cache_lock:
+        return series_locks.setdefault(key, Lock())
+
+
+def get_rates(from_currency, to_currency, publisher, interval, start_date, end_date, fetch, cache_dir=FX_CACHE_DIR, now=None):
+    """
+    :param from_currency: ex. 'USD'
+    :param to_currency: ex. 'EUR'
+    :param publisher: ex. 'ICIS'
+    :param interval: ex. 'daily'
+    :param start_date: first date of the rates
+    :param end_date: last date of the rates (included)
+    :param fetch: fetch(start_date, end_date) returning the rates of the series from the database, columns RATE_COLUMNS
+    :param cache_dir: directory of the disk tier, None for the memory tier only
+    :param now: time of the request, now by default
+    :return: dataframe RATE_COLUMNS of the rates between start_date and end_date, ordered by date
+    """
+    key = (from_currency, to_currency, publisher, interval)
+    start_date, end_date = pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize()
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now()
+    with series_lock(key):
+        with cache_lock:
+            entry = memory_cache.get(key)
+        if entry is None and cache_dir is not None:
+            entry = load_entry(key, cache_dir)
+
+        fetch_from = None
+        if entry is None or start_date < entry['start_date']:
+            fetch_from = start_date
+        elif end_date > entry['end_date'] or now - entry['fetched_at'] > FX_CACHE_TTL:
+            # incremental top-up, from the day after the last cached rate
+            last_rate = entry['rates'].startlocTimeStamp.max()
+            fetch_from = max(entry['start_date'], last_rate + pd.Timedelta(days=1)) if pd.notnull(last_rate) else entry['start_date']
+        if fetch_from is not None:
+            fetch_to = max(end_date, entry['end_date']) if entry is not None else end_date
+            rates = merge_rates(entry['rates'] if entry is not None else None, fetch(fetch_from, fetch_to))
+            entry = {'rates': rates,
+                     'start_date': min(start_date, entry['start_date']) if entry is not None else start_date,
+                     'end_date': fetch_to,
+                     'fetched_at': now}
+            if cache_dir is not None:
+                save_entry(key, entry, cache_dir)
+
+        with cache_lock:
+            memory_cache.pop(key, None)
+            memory_cache[key] = entry
+            while len(memory_cache) > FX_CACHE_SIZE:
+                memory_cache.popitem(last=False)
+    rates = entry['rates']
+    dates = rates.startlocTimeStamp
+    return rates[(dates >= start_date).values & (dates < end_date + pd.Timedelta(days=1)).values].reset_index(drop=True)
+
+
+def clear_memory():
+    """
+    :return: empties the memory tier, the next requests are served by the disk or the database
+    """
+    with cache_lock:
+        memory_cache.clear()
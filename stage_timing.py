@@ -0,0 +1,189 @@
+
+import cProfile
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from threading import current_thread, local
+import pandas as pd
+
+try:
+    import resource
+except ImportError:     # windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+"""
+@summary:
+Timing and memory instrumentation of the pipeline stages (getsqldata, clean_data, create_single_curves, ...).
+    For every stage a json report is logged through the run-time controller's logger:
+        {"stage": ..., "wall_s": ..., "cpu_s": ..., "peak_rss_mb": ..., "traced_peak_mb": ..., "rows_in": ..., "rows_out": ...}
+
+    @DecorateErrorHandling
+    @timed_stage()
+    def clean_data(df): ...
+
+    with stage('insert', rows_in=len(df)) as record:
+        record['rows_out'] = insertValuetoSQL(df)
+
+    Opt-in, as they slow the stages down:
+        CURVE_TRACE_MEMORY=1        peak of python allocations of the stage with tracemalloc
+        CURVE_PROFILE_DIR=<dir>     cProfile dump of each stage to <dir>/<stage>.prof
+"""
+
+TRACE_MEMORY = os.environ.get('CURVE_TRACE_MEMORY') == '1'
+PROFILE_DIR = os.environ.get('CURVE_PROFILE_DIR')
+
+#One profiler per thread, a nested stage is profiled within the dump of the outer stage
+profiling = local()
+
+
+def get_logger():
+    """
+    :return: logger of the run-time controller of the current thread, module logger outside of a CustomThread
+    """
+    thread = current_thread()
+    if hasattr(thread, 'getRunTimeController'):
+        return thread.getRunTimeController().logger.getLogger()
+    return logging.getLogger(__name__)
+
+
+def peak_rss_mb():
+    """
+    :return: peak resident memory of the process in MB, None if it cannot be read on this platform
+    """
+    if resource is not None:
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)   # kB on linux
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / 2 ** 20, 1)
+    return None
+
+
+def count_rows(value):
+    """
+    :param value: stage input or output
+    :return: number of rows of a dataframe, sum over a tuple/list of dataframes, the value itself for a row count
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)) and any(isinstance(v, pd.DataFrame) for v in value):
+        return sum(len(v) for v in value if isinstance(v, pd.DataFrame))
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return None
+
+
+class StageTimer(object):
+    """
+    Accumulates wall time, cpu time and traced memory peak of a stage over one or several start/stop intervals
+    (several for a generator stage, measured only while it produces its partitions)
+    """
+
+    def __init__(self, name, rows_in=None):
+        self.record = {'stage': name, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': None, 'traced_peak_mb': None,
+                       'rows_in': rows_in, 'rows_out': None}
+        self.profiler = cProfile.Profile() if PROFILE_DIR else None
+        self.tracing = False
+
+    def start(self):
+        if TRACE_MEMORY and not tracemalloc.is_tracing():   # nested stages are traced by the outer one
+            tracemalloc.start()
+            self.tracing = True
+        if self.profiler is not None and getattr(profiling, 'active', None) in (None, self):
+            profiling.active = self
+            self.profiler.enable()
+        self.wall, self.cpu = time.perf_counter(), time.thread_time()
+
+    def stop(self):
+        self.record['wall_s'] += time.perf_counter() - self.wall
+        self.record['cpu_s'] += time.thread_time() - self.cpu
+        if getattr(profiling, 'active', None) is self:
+            self.profiler.disable()
+            profiling.active = None
+        if self.tracing:
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            self.record['traced_peak_mb'] = round(max(peak, self.record['traced_peak_mb'] or 0), 1)
+            tracemalloc.stop()
+            self.tracing = False
+
+    def report(self):
+        self.record['wall_s'] = round(self.record['wall_s'], 4)
+        self.record['cpu_s'] = round(self.record['cpu_s'], 4)
+        self.record['peak_rss_mb'] = peak_rss_mb()
+        if self.profiler is not None and self.profiler.getstats():
+            self.profiler.dump_stats(os.path.join(PROFILE_DIR, '%s.prof' % self.record['stage']))
+        get_logger().info(json.dumps(self.record))
+        return self.record
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    :param name: stage name in the report
+    :param rows_in: number of input rows
+    :return: context manager yielding the report dict, set record['rows_out'] inside the block.
+             The report is logged when the block exits, with 'failed': True if it raised
+    """
+    timer = StageTimer(name, rows_in)
+    timer.start()
+    try:
+        yield timer.record
+    except BaseException:
+        timer.record['failed'] = True
+        raise
+    finally:
+        timer.stop()
+        timer.report()
+
+
+def timed_generator(name, generator, rows_in=None):
+    """
+    :param name: stage name in the report
+    :param generator: generator of dataframes, ex. iter_single_curves(df)
+    :param rows_in: number of input rows
+    :return: same generator, reporting the time spent producing the items (not consuming them) once exhausted
+    """
+    timer, rows_out = StageTimer(name, rows_in), 0
+    while True:
+        timer.start()
+        try:
+            item = next(generator)
+        except StopIteration:
+            break
+        finally:
+            timer.stop()
+        rows_out += count_rows(item) or 0
+        yield item
+    timer.record['rows_out'] = rows_out
+    timer.report()
+
+
+def timed_stage(name=None, input_rows=True):
+    """
+    :param name: stage name in the report, the function name by default
+    :param input_rows: report the rows of the first argument as rows_in, False when it is not the stage input
+    :return: decorator reporting each call of the function as a stage, rows_in being the rows of its first argument.
+             Goes under @DecorateErrorHandling so failures are still reported before being handled
+    """
+    def decorator(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            rows_in = count_rows(args[0]) if args and input_rows else None
+            if inspect.isgeneratorfunction(function):
+                return timed_generator(stage_name, function(*args, **kwargs), rows_in)
+            with stage(stage_name, rows_in) as record:
+                result = function(*args, **kwargs)
+                record['rows_out'] = count_rows(result)
+            return result
+        return wrapper
+    return decorator
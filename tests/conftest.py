@@ -0,0 +1,38 @@
+
+import builtins
+import os
+import sys
+import warnings
+import pandas as pd
+import pytest
+
+"""
+@summary:
+Fixtures of the tests, in tests/fixtures:
+    contracts.csv        synthetic contracts, curve_benchmark.synthetic_contracts(3, 1, seed=7) cleaned by
+                         fill_month_quarter_values + clean_data(as_of=2020-01-02): hubs hub000 to hub002 traded on
+                         2020-01-02, not recorded from the input table
+    exchange_rates.csv   USD/EUR and GBP/EUR rates published on business days, holidays missing
+The pipeline modules run inside the framework, whose globals are stood in for here: DecorateErrorHandling lets
+the errors through, so that the tests see them.
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'tests', 'fixtures')
+
+sys.path.insert(0, ROOT)
+builtins.DecorateErrorHandling = getattr(builtins, 'DecorateErrorHandling', lambda function: function)
+warnings.filterwarnings("ignore")
+
+
+@pytest.fixture
+def contracts():
+    import commodities_futures_curve as cfc
+    return cfc.apply_schema(pd.read_csv(os.path.join(FIXTURES, 'contracts.csv')))
+
+
+@pytest.fixture
+def exchange_rates():
+    rates = pd.read_csv(os.path.join(FIXTURES, 'exchange_rates.csv'))
+    rates['utcTimeStamp'] = pd.to_datetime(rates.startlocTimeStamp)
+    return rates
@@ -0,0 +1,41 @@
+
+import pandas as pd
+import commodities_futures_curve as cfc
+import curve_benchmark
+
+"""
+@summary:
+The vectorized single and mixed curve builders against the contract by contract ones, on the synthetic contracts
+"""
+
+SINGLE_KEYS = ['commodity', 'market', 'exchange', 'contract']
+MIXED_KEYS = ['commodity', 'market', 'exchange']
+
+
+def test_single_curves_match_loop(contracts):
+    loop_curve = cfc.create_single_curves(contracts.copy(), vectorized=False)
+    vector_curve = cfc.create_single_curves(contracts.copy())
+    assert len(vector_curve) > 0
+    assert curve_benchmark.same_curves(loop_curve, vector_curve, SINGLE_KEYS)
+
+
+def test_mixed_curve_matches_loop(contracts):
+    as_of = curve_benchmark.dump_trade_date(contracts)
+    loop_curve = cfc.create_mixed_curve(contracts.copy(), vectorized=False, as_of=as_of)
+    vector_curve = cfc.create_mixed_curve(contracts.copy(), as_of=as_of)
+    assert len(vector_curve) > 0
+    assert curve_benchmark.same_curves(loop_curve, vector_curve, MIXED_KEYS, shared_days=True)
+
+
+def test_mixed_curve_one_row_per_day(contracts):
+    curve = cfc.create_mixed_curve(contracts.copy(), as_of=curve_benchmark.dump_trade_date(contracts))
+    assert not curve.duplicated(MIXED_KEYS + ['dateIndex']).any()
+    for _, hub in curve.groupby(MIXED_KEYS, observed=True):
+        days = pd.DatetimeIndex(hub.dateIndex).sort_values()
+        assert (days == pd.date_range(days[0], days[-1])).all()
+
+
+def test_streamed_curves_match(contracts):
+    as_of = curve_benchmark.dump_trade_date(contracts)
+    streamed = pd.concat(cfc.iter_mixed_curves(contracts.copy(), as_of=as_of))
+    assert curve_benchmark.same_curves(streamed, cfc.create_mixed_curve(contracts.copy(), as_of=as_of), MIXED_KEYS)
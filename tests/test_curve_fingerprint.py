@@ -0,0 +1,89 @@
+
+import pytest
+import commodities_futures_curve as cfc
+import curve_writer
+from curve_fingerprint import partition_fingerprints, load_fingerprints, dirty_partitions, save_fingerprints
+
+"""
+@summary:
+Incremental rebuild: change detection of the partitions, and replacement of their curves in the SQLite stand-in
+of the output table, only the confirmed partitions being recorded
+"""
+
+TABLE = 'commodity_price_forward_curve_table'
+
+
+@pytest.fixture
+def connection():
+    connection = curve_writer.sqlite_tables()
+    yield connection
+    connection.close()
+
+
+@pytest.fixture(autouse=True)
+def no_snapshot_store(monkeypatch):
+    monkeypatch.setattr(cfc, 'SNAPSHOT_STORE', False)
+
+
+def table_rows(connection):
+    return connection.execute('SELECT COUNT(*) FROM {table}'.format(table=TABLE)).fetchone()[0]
+
+
+def test_fingerprints_ignore_row_order(contracts):
+    fingerprints = partition_fingerprints(contracts)
+    shuffled = partition_fingerprints(contracts.sample(frac=1, random_state=0))
+    assert len(fingerprints) == 3
+    assert fingerprints.fingerprint.tolist() == shuffled.fingerprint.tolist()
+
+
+def test_changed_partition_is_dirty(contracts, tmp_path):
+    path = str(tmp_path / 'fingerprints.json')
+    save_fingerprints(partition_fingerprints(contracts), path)
+    changed = contracts.copy()
+    changed.loc[changed.market == 'hub001', 'price'] += 1
+    dirty = dirty_partitions(partition_fingerprints(changed), load_fingerprints(path))
+    assert dirty.market.astype(str).tolist() == ['hub001']
+    assert dirty_partitions(partition_fingerprints(contracts), load_fingerprints(path)).empty
+
+
+def test_configuration_change_rebuilds_all(contracts):
+    plain = partition_fingerprints(contracts, {'shape_mixed_curve': False})
+    shaped = partition_fingerprints(contracts, {'shape_mixed_curve': True})
+    assert (plain.fingerprint != shaped.fingerprint).all()
+
+
+def test_replace_is_idempotent(contracts, connection):
+    partitions = partition_fingerprints(contracts)
+    replace = curve_writer.sqlite_replace(connection)
+    replaced = cfc.replacePartitionsInSQL(contracts, partitions, replace, TABLE)
+    rows = table_rows(connection)
+    assert len(replaced) == len(partitions) and rows > 0
+    cfc.replacePartitionsInSQL(contracts, partitions, replace, TABLE)
+    assert table_rows(connection) == rows
+
+
+def test_failed_partition_rolls_back(contracts, connection, tmp_path):
+    partitions = partition_fingerprints(contracts)
+    replace = curve_writer.sqlite_replace(connection)
+    cfc.replacePartitionsInSQL(contracts, partitions, replace, TABLE)
+    rows = table_rows(connection)
+
+    def failing_replace(table_name, delete_sql, tables, column_types):
+        if 'hub001' in delete_sql:   # the delete runs, then the insert fails
+            tables = [table.assign(unknown_column=1) for table in tables]
+        return replace(table_name, delete_sql, tables, column_types)
+
+    replaced = cfc.replacePartitionsInSQL(contracts, partitions, failing_replace, TABLE)
+    assert sorted(replaced.market.astype(str)) == ['hub000', 'hub002']
+    assert table_rows(connection) == rows
+
+    path = str(tmp_path / 'fingerprints.json')
+    save_fingerprints(replaced, path)
+    assert dirty_partitions(partitions, load_fingerprints(path)).market.astype(str).tolist() == ['hub001']
+
+
+def test_partition_delete_sql_limits_trade_date(contracts):
+    partition = partition_fingerprints(contracts).iloc[0]
+    sql = cfc.partition_delete_sql(partition, TABLE)
+    assert "utcTradeDate >= '2020-01-02' AND utcTradeDate < '2020-01-03'" in sql
+    assert "market = '%s'" % partition.market in sql
@@ -0,0 +1,77 @@
+
+import numpy as np
+import pandas as pd
+import pytest
+import commodities_futures_curve as cfc
+import curve_service
+import curve_writer
+from curve_fingerprint import partition_fingerprints
+
+"""
+@summary:
+Refresh of the query service from the SQLite stand-in of the output table, with contracts of one trade date
+settled at different times
+"""
+
+TABLE = 'commodity_price_forward_curve_table'
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    monkeypatch.setattr(cfc, 'SNAPSHOT_STORE', False)
+    monkeypatch.setattr(curve_service, 'curves', {})
+    monkeypatch.setattr(curve_service, 'loaded_versions', {})
+    connection = curve_writer.sqlite_tables()
+    yield connection
+    connection.close()
+
+
+def publish(connection, contracts):
+    cfc.replacePartitionsInSQL(contracts, partition_fingerprints(contracts), curve_writer.sqlite_replace(connection), TABLE)
+
+
+def fetch(connection):
+    return lambda sql: connection.execute(sql).fetchall()
+
+
+def settled_at_noon(contracts):
+    """
+    :return: contracts with the day contracts settled at 12:00, the others keep their 17:00 settlement
+    """
+    contracts = contracts.copy()
+    day = (contracts.contractType == 'day').values
+    contracts.loc[day, 'utcTimeStamp'] = contracts.utcTimeStamp[day].dt.normalize() + pd.Timedelta(hours=12)
+    return contracts
+
+
+def stored_price(connection, curve_type, tenor, day):
+    sql = ''' SELECT price FROM {table} WHERE commodity = 'power' AND market = 'hub000' AND exchange = 'eex'
+              AND curve_type = '{curve_type}' AND contractType1 = '{tenor}' AND utcTimeStamp = '{day}' '''
+    return connection.execute(sql.format(table=TABLE, curve_type=curve_type, tenor=tenor, day=day)).fetchone()[0]
+
+
+def test_refresh_loads_whole_trade_day(contracts, connection):
+    publish(connection, settled_at_noon(contracts))
+    assert len(curve_service.refresh(fetch(connection), TABLE)) == 6
+
+    day_price = stored_price(connection, 'single_curve', 'day', '2020-01-03')
+    assert curve_service.point('power', 'hub000', 'eex', '2020-01-03', 'single_curve', 'day') == pytest.approx(day_price)
+    assert curve_service.point('power', 'hub000', 'eex', '2020-01-03') == pytest.approx(day_price)
+    for tenor in ['day', 'weekend', 'month', 'quarter']:
+        assert curve_service.get_curve('power', 'hub000', 'eex', 'single_curve', tenor) is not None
+
+
+def test_refresh_same_day_republish(contracts, connection):
+    contracts = settled_at_noon(contracts)
+    publish(connection, contracts)
+    curve_service.refresh(fetch(connection), TABLE)
+    assert curve_service.refresh(fetch(connection), TABLE) == []
+
+    republished = contracts.copy()
+    republished.loc[(republished.market == 'hub000').values, 'price'] += 1
+    publish(connection, republished)
+    reloaded = curve_service.refresh(fetch(connection), TABLE)
+    assert reloaded == [('power', 'hub000', 'eex', 'mixed_curve'), ('power', 'hub000', 'eex', 'single_curve')]
+    day_price = stored_price(connection, 'single_curve', 'day', '2020-01-03')
+    assert curve_service.point('power', 'hub000', 'eex', '2020-01-03', 'single_curve', 'day') == pytest.approx(day_price)
+    assert not np.isnan(curve_service.strip_average('power', 'hub000', 'eex', '2020-02-01', '2020-02-29'))
@@ -0,0 +1,63 @@
+
+import numpy as np
+import pandas as pd
+import full_year_price_curve as fyc
+import curve_benchmark
+
+"""
+@summary:
+Exchange rate as-of join of the currency conversion, and the reindexed gap fill of the daily series
+"""
+
+
+def test_rates_asof_previous_publication(exchange_rates):
+    usd = exchange_rates[exchange_rates.fromCurrency == 'USD'].set_index('utcTimeStamp').rate
+    dates = pd.to_datetime(['2020-01-06', '2020-01-04', '2020-01-05', '2020-01-01', '2019-12-25'])
+    rates = fyc.exchange_rates_asof(dates, exchange_rates)
+    # published day, weekend and holidays take the last rate published on or before them
+    expected = [usd['2020-01-06'], usd['2020-01-03'], usd['2020-01-03'], usd['2019-12-31'], usd['2019-12-24']]
+    assert np.allclose(rates, expected)
+
+
+def test_rates_asof_edges(exchange_rates):
+    first = exchange_rates[exchange_rates.fromCurrency == 'USD'].rate.iloc[0]
+    rates = fyc.exchange_rates_asof(pd.Series(pd.to_datetime(['2019-01-01', None])), exchange_rates)
+    assert rates[0] == first   # before the first rate
+    assert np.isnan(rates[1])
+    assert np.isnan(fyc.exchange_rates_asof(pd.to_datetime(['2020-01-06']), exchange_rates, 'CHF')).all()
+
+
+def test_rates_asof_pair(exchange_rates):
+    gbp = exchange_rates[exchange_rates.fromCurrency == 'GBP'].set_index('utcTimeStamp').rate
+    dates = pd.to_datetime(['2020-02-14', '2020-02-17'])
+    expected = [gbp[:date].iloc[-1] for date in dates]
+    assert np.allclose(fyc.exchange_rates_asof(dates, exchange_rates, 'GBP'), expected)
+
+
+def test_rate_conversion(exchange_rates):
+    data = pd.DataFrame({'utcTimeStamp': pd.to_datetime(['2020-01-04', '2020-01-06']), 'price': [81.41, 40.705]})
+    converted = fyc.rate_conversion(data, exchange_rates, metric_change=8.141, metrics_name='barrel_to_MW/h')
+    rates = fyc.exchange_rates_asof(data.utcTimeStamp, exchange_rates)
+    assert np.allclose(converted.price_usd_per_mwh, [10.0, 5.0])
+    assert np.allclose(converted.price_euro_per_mwh, [10.0 * rates[0], 5.0 * rates[1]])
+
+
+def test_append_rows_matches_rowwise(exchange_rates):
+    usd = exchange_rates[exchange_rates.fromCurrency == 'USD'][['startlocTimeStamp', 'fromCurrency', 'toCurrency', 'rate']]
+    usd = usd.set_index(pd.to_datetime(usd.startlocTimeStamp))
+    calendar = pd.DataFrame(index=pd.date_range('2019-12-20', '2020-03-31'), columns=usd.columns)
+    filled = fyc.append_rows(usd, calendar.copy())
+    reference = curve_benchmark.append_rows_rowwise(usd, calendar.copy())
+    assert filled.astype(str).equals(reference.astype(str))
+
+
+def test_business_day_fill_holds_last_trading_day():
+    days = pd.to_datetime(['2019-03-12', '2019-03-14', '2019-03-15', '2019-03-16', '2019-03-18'])
+    quotes = pd.DataFrame({'price': [75.0, 77.0, 78.0, 90.0, 79.0]}, index=days)
+    calendar = pd.DataFrame(index=pd.date_range('2019-03-11', '2019-03-18'), columns=['price'], dtype=float)
+    filled = fyc.append_rows(quotes, calendar, fill='business_day', exchange='ice').price
+    # missing Wednesday holds Tuesday (no look-ahead), the Saturday quote is kept, Sunday holds Friday
+    expected = [75.0, 75.0, 75.0, 77.0, 78.0, 90.0, 78.0, 79.0]
+    assert filled.tolist() == expected
+    linear = fyc.append_rows(quotes, calendar, fill='linear').price
+    assert linear['2019-03-13'] == 76.0